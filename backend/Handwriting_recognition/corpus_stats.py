@@ -0,0 +1,221 @@
+"""
+Running corpus statistics for approved OCR documents.
+save_output() records each document's contribution (document count, words,
+characters, user corrections and an OCR confidence histogram) into four
+rollup rows: per (day, user), per day, per user and overall. Any (day, user)
+combination, including the overall totals, is then a single row lookup.
+
+Each rollup row names its scope explicitly and leaves the dimensions it
+does not group by empty, so no user or day value can be mistaken for a
+total.
+
+Aggregates are stored in SQLite (corpus_stats.db). To recompute them from
+nlp_ready/ after data loss or a schema change:
+
+    python corpus_stats.py rebuild
+"""
+
+import glob
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+NLP_DIR = "nlp_ready"
+STATS_DB = os.environ.get('CORPUS_STATS_DB', 'corpus_stats.db')
+
+# Rollup scopes, and the value stored in the dimensions a scope does not group by
+DAY_USER, DAY, USER, ALL = "day_user", "day", "user", "all"
+UNUSED = ""
+HISTOGRAM_BUCKETS = 10
+HISTOGRAM_COLUMNS = [f"confidence_{i}" for i in range(HISTOGRAM_BUCKETS)]
+COUNTER_COLUMNS = ["documents", "corrected", "words", "characters", "confidence_sum"] + HISTOGRAM_COLUMNS
+
+
+def confidence_bucket(confidence):
+    """Histogram bucket (0-9) for a confidence between 0 and 1"""
+    return min(HISTOGRAM_BUCKETS - 1, max(0, int(float(confidence or 0.0) * HISTOGRAM_BUCKETS)))
+
+
+class CorpusStats:
+    """
+    Incrementally maintained aggregates over saved documents.
+
+    Each document's last recorded contribution is kept, so saving the same
+    document again replaces its numbers instead of counting it twice.
+    """
+
+    def __init__(self, path=STATS_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        counters = ", ".join(f"{column} REAL NOT NULL DEFAULT 0" for column in COUNTER_COLUMNS)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS corpus_rollups ("
+            f" scope TEXT NOT NULL, day TEXT NOT NULL, user_id TEXT NOT NULL, {counters},"
+            " PRIMARY KEY (scope, day, user_id))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS corpus_documents ("
+            " document_id TEXT PRIMARY KEY, day TEXT NOT NULL, user_id TEXT NOT NULL,"
+            " corrected INTEGER NOT NULL, words INTEGER NOT NULL, characters INTEGER NOT NULL,"
+            " confidence REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _apply(self, conn, day, user_id, corrected, words, characters, confidence, sign):
+        """Add (sign=1) or remove (sign=-1) one document from its four rollup rows"""
+        values = {column: 0 for column in COUNTER_COLUMNS}
+        values.update({
+            "documents": sign,
+            "corrected": sign * int(bool(corrected)),
+            "words": sign * words,
+            "characters": sign * characters,
+            "confidence_sum": sign * confidence,
+        })
+        values[HISTOGRAM_COLUMNS[confidence_bucket(confidence)]] = sign
+
+        columns = ", ".join(COUNTER_COLUMNS)
+        placeholders = ", ".join("?" for _ in COUNTER_COLUMNS)
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in COUNTER_COLUMNS)
+        rows = [
+            (DAY_USER, day, user_id), (DAY, day, UNUSED), (USER, UNUSED, user_id), (ALL, UNUSED, UNUSED)
+        ]
+        conn.executemany(
+            f"INSERT INTO corpus_rollups (scope, day, user_id, {columns}) VALUES (?, ?, ?, {placeholders})"
+            f" ON CONFLICT(scope, day, user_id) DO UPDATE SET {updates}",
+            [(*row, *[values[column] for column in COUNTER_COLUMNS]) for row in rows],
+        )
+
+    def record(self, document_id, day, user_id, words, characters, corrected, confidence):
+        """Record (or re-record) one saved document"""
+        day, user_id = day or "unknown", user_id or "anonymous"
+        confidence = float(confidence or 0.0)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous = conn.execute(
+                "SELECT day, user_id, corrected, words, characters, confidence"
+                " FROM corpus_documents WHERE document_id = ?",
+                (document_id,),
+            ).fetchone()
+            if previous:
+                self._apply(conn, *previous, sign=-1)
+            self._apply(conn, day, user_id, corrected, words, characters, confidence, sign=1)
+            conn.execute(
+                "INSERT OR REPLACE INTO corpus_documents"
+                " (document_id, day, user_id, corrected, words, characters, confidence)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (document_id, day, user_id, int(bool(corrected)), words, characters, confidence),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def record_document(self, nlp_data):
+        """Record a document from its nlp_ready JSON structure"""
+        metadata = nlp_data.get("metadata", {})
+        content = nlp_data.get("content", {})
+        self.record(
+            document_id=nlp_data["document_id"],
+            day=nlp_data.get("timestamp", "")[:10] or "unknown",
+            user_id=metadata.get("user_id"),
+            words=content.get("word_count", 0),
+            characters=content.get("character_count", 0),
+            corrected=nlp_data.get("ocr_details", {}).get("user_corrections", False),
+            confidence=metadata.get("confidence_score", 0.0),
+        )
+
+    def _format(self, day, user_id, row):
+        counters = dict(zip(COUNTER_COLUMNS, row)) if row else {column: 0 for column in COUNTER_COLUMNS}
+        documents = int(counters["documents"])
+        histogram = {
+            f"{i / HISTOGRAM_BUCKETS:.1f}-{(i + 1) / HISTOGRAM_BUCKETS:.1f}": int(counters[column])
+            for i, column in enumerate(HISTOGRAM_COLUMNS)
+        }
+        return {
+            "day": day,
+            "user_id": user_id,
+            "documents": documents,
+            "total_words": int(counters["words"]),
+            "total_characters": int(counters["characters"]),
+            "corrected_documents": int(counters["corrected"]),
+            "correction_rate": counters["corrected"] / documents if documents else 0.0,
+            "average_confidence": counters["confidence_sum"] / documents if documents else 0.0,
+            "confidence_histogram": histogram,
+        }
+
+    def get(self, day=None, user_id=None):
+        """Aggregates for one day and/or user (None means all)"""
+        scope = {(True, True): DAY_USER, (True, False): DAY, (False, True): USER, (False, False): ALL}[
+            (bool(day), bool(user_id))
+        ]
+        row = self._connect().execute(
+            f"SELECT {', '.join(COUNTER_COLUMNS)} FROM corpus_rollups"
+            " WHERE scope = ? AND day = ? AND user_id = ?",
+            (scope, day or UNUSED, user_id or UNUSED),
+        ).fetchone()
+        return self._format(day or None, user_id or None, row)
+
+    def breakdown(self, group_by, day=None, user_id=None):
+        """Aggregates for every day (group_by="day") or every user (group_by="user")"""
+        if group_by == "day":
+            where, params = ("scope = ? AND user_id = ?", (DAY_USER, user_id)) if user_id else ("scope = ?", (DAY,))
+        elif group_by == "user":
+            where, params = ("scope = ? AND day = ?", (DAY_USER, day)) if day else ("scope = ?", (USER,))
+        else:
+            raise ValueError(f"Unknown group_by: {group_by}")
+        rows = self._connect().execute(
+            f"SELECT day, user_id, {', '.join(COUNTER_COLUMNS)} FROM corpus_rollups"
+            f" WHERE {where} ORDER BY day, user_id",
+            params,
+        ).fetchall()
+        return [self._format(row[0] or None, row[1] or None, row[2:]) for row in rows]
+
+    def rebuild(self, nlp_dir=NLP_DIR):
+        """Recompute every aggregate from the saved documents. Returns the document count."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM corpus_rollups")
+            conn.execute("DELETE FROM corpus_documents")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        count = 0
+        for path in sorted(glob.glob(os.path.join(nlp_dir, "nlp_*.json"))):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.record_document(json.load(f))
+                count += 1
+            except Exception as e:
+                logging.error(f"Skipping {path} during stats rebuild: {e}")
+        return count
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["rebuild"]:
+        raise SystemExit("Usage: python corpus_stats.py rebuild")
+    stats = CorpusStats()
+    logging.info(f"Rebuilt corpus statistics from {stats.rebuild()} documents")
+    logging.info(json.dumps(stats.get(), indent=2))
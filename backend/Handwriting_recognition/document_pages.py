@@ -0,0 +1,137 @@
+"""
+Page splitting for uploaded documents.
+Multi-page TIFF and PDF scans are split into per-page PNG images one page at
+a time, so a whole notebook never has to be decoded into memory at once.
+Single raster images are passed through unchanged.
+
+pdfium is not thread-safe, even across different documents, and these
+helpers run on the request threadpool. Every pdfium call is therefore made
+while holding one module-level lock. Only opening and rasterising a page is
+serialised; PNG encoding and OCR of rendered pages run in parallel.
+"""
+
+import io
+import threading
+
+from PIL import Image
+
+# Render resolution for PDF pages; 200 DPI is plenty for handwriting OCR
+PDF_RENDER_DPI = 200
+
+
+def detect_document_type(path):
+    """
+    Identify an uploaded file by its magic bytes
+
+    Returns:
+        str: "pdf", "tiff" or "image"
+    """
+    with open(path, 'rb') as f:
+        header = f.read(4)
+    if header.startswith(b'%PDF'):
+        return "pdf"
+    if header in (b'II*\x00', b'MM\x00*'):
+        return "tiff"
+    return "image"
+
+
+# Held for every call into pdfium
+_pdfium_lock = threading.Lock()
+
+
+def _open_pdf(path):
+    """Open a PDF (caller holds _pdfium_lock)"""
+    # pypdfium2 is only needed for PDF uploads, so import it on demand
+    import pypdfium2 as pdfium
+    return pdfium.PdfDocument(path)
+
+
+def _render_pdf_page(pdf, index, dpi):
+    """Rasterise one page into a standalone PIL image (caller holds _pdfium_lock)"""
+    page = pdf[index]
+    try:
+        bitmap = page.render(scale=dpi / 72)
+        try:
+            # Copy out of pdfium's buffer so the image outlives the bitmap
+            return bitmap.to_pil().copy()
+        finally:
+            bitmap.close()
+    finally:
+        page.close()
+
+
+def count_pages(path):
+    """Number of pages in the document (1 for a plain image)"""
+    doc_type = detect_document_type(path)
+    if doc_type == "pdf":
+        with _pdfium_lock:
+            pdf = _open_pdf(path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    if doc_type == "tiff":
+        with Image.open(path) as img:
+            return getattr(img, 'n_frames', 1)
+    return 1
+
+
+def _to_png(img):
+    if img.mode == '1':
+        # Bilevel fax-style scans
+        img = img.convert('L')
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def iter_document_pages(path, dpi=PDF_RENDER_DPI):
+    """
+    Yield the pages of a document one at a time
+
+    Args:
+        path (str): Path to the uploaded file
+        dpi (int): Render resolution for PDF pages
+
+    Yields:
+        tuple: (page_number starting at 1, image bytes)
+    """
+    doc_type = detect_document_type(path)
+
+    if doc_type == "pdf":
+        # The lock is taken per page, never held across a yield
+        with _pdfium_lock:
+            pdf = _open_pdf(path)
+            page_count = len(pdf)
+        try:
+            for index in range(page_count):
+                with _pdfium_lock:
+                    image = _render_pdf_page(pdf, index, dpi)
+                yield index + 1, _to_png(image)
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+
+    elif doc_type == "tiff":
+        with Image.open(path) as img:
+            for index in range(getattr(img, 'n_frames', 1)):
+                img.seek(index)
+                yield index + 1, _to_png(img)
+
+    else:
+        with open(path, 'rb') as f:
+            yield 1, f.read()
+
+
+def first_page_image(path):
+    """Open the first page of a document as a PIL image (for previews)"""
+    if detect_document_type(path) == "pdf":
+        pages = iter_document_pages(path, dpi=72)
+        try:
+            _, content = next(pages)
+        finally:
+            pages.close()
+        return Image.open(io.BytesIO(content))
+    return Image.open(path)
@@ -0,0 +1,451 @@
+"""
+Background NLP enrichment for saved OCR documents.
+/api/save only writes the document and enqueues its ID on a durable SQLite
+queue. A worker claims queued documents in batches and runs tokenization,
+sentence segmentation, language detection and normalisation on a process
+pool, one sub-batch per process. It then writes the enriched nlp_ready
+section back into nlp_ready/nlp_<id>.json.
+
+save_output() and the worker both write nlp_<id>.json, so both do it while
+holding the queue database's write lock (EnrichmentQueue.document_lock). The
+worker only writes its result if the document's timestamp still matches the
+text it enriched; a newer save has re-queued the document and wins.
+
+The worker runs inside the API process by default (ENRICHMENT_INLINE_WORKER=1)
+with a small pool (ENRICHMENT_INLINE_PROCESSES, default 1), since every
+uvicorn worker starts its own. It can also run on its own, using every core
+by default (ENRICHMENT_PROCESSES):
+
+    python enrichment.py                # run until interrupted
+    python enrichment.py --drain        # process the backlog and exit
+    python enrichment.py --enqueue-all  # queue every saved document first
+"""
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+
+NLP_DIR = "nlp_ready"
+QUEUE_DB = os.environ.get('ENRICHMENT_QUEUE_DB', 'enrichment_queue.db')
+BATCH_SIZE = int(os.environ.get('ENRICHMENT_BATCH_SIZE', '32'))
+PROCESSES = int(os.environ.get('ENRICHMENT_PROCESSES', str(os.cpu_count() or 1)))
+INLINE_PROCESSES = int(os.environ.get('ENRICHMENT_INLINE_PROCESSES', '1'))
+MAX_ATTEMPTS = 3
+
+TOKEN_RE = re.compile(r"\w+(?:['’\-]\w+)*|[^\w\s]", re.UNICODE)
+# Sentence ends at . ! ? (or the Devanagari danda) followed by whitespace,
+# unless the period belongs to a common abbreviation or an initial
+SENTENCE_END_RE = re.compile(r"(?<=[.!?।])[\"')\]]*\s+")
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "jr", "sr", "vs", "etc", "no", "fig", "e.g", "i.e"}
+
+# Scripts that identify a language on their own (first code point -> ISO 639-1)
+SCRIPT_LANGUAGES = [
+    (0x0900, 0x097F, "hi"), (0x0980, 0x09FF, "bn"), (0x0A00, 0x0A7F, "pa"),
+    (0x0A80, 0x0AFF, "gu"), (0x0B00, 0x0B7F, "or"), (0x0B80, 0x0BFF, "ta"),
+    (0x0C00, 0x0C7F, "te"), (0x0C80, 0x0CFF, "kn"), (0x0D00, 0x0D7F, "ml"),
+    (0x0600, 0x06FF, "ar"), (0x0400, 0x04FF, "ru"), (0x4E00, 0x9FFF, "zh"),
+]
+# Frequent function words for Latin-script languages
+STOPWORDS = {
+    "en": {"the", "and", "of", "to", "a", "in", "is", "was", "he", "it", "that", "his", "with", "for"},
+    "es": {"el", "la", "de", "que", "y", "en", "los", "se", "del", "las", "por", "un", "con", "una"},
+    "fr": {"le", "la", "de", "et", "les", "des", "est", "un", "une", "du", "que", "dans", "pour", "il"},
+    "de": {"der", "die", "und", "das", "ist", "nicht", "ein", "zu", "den", "mit", "sich", "des", "auf", "er"},
+    "pt": {"o", "a", "de", "que", "e", "do", "da", "em", "um", "para", "com", "não", "uma", "os"},
+    "it": {"il", "di", "che", "e", "la", "un", "per", "non", "in", "una", "sono", "del", "della", "lo"},
+}
+
+
+def normalize_text(text):
+    """Unicode NFKC normalisation with whitespace collapsed inside each line"""
+    text = unicodedata.normalize('NFKC', text)
+    lines = [' '.join(line.split()) for line in text.splitlines()]
+    return '\n'.join(lines).strip()
+
+
+def tokenize(text):
+    """Split text into word and punctuation tokens"""
+    return TOKEN_RE.findall(text)
+
+
+def split_sentences(text):
+    """Segment text into sentences, keeping abbreviations and initials intact"""
+    flat = ' '.join(text.split())
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_RE.finditer(flat):
+        candidate = flat[start:match.start()].rstrip()
+        last_word = candidate.rsplit(' ', 1)[-1].rstrip('.').lower()
+        if candidate.endswith('.') and (last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha())):
+            continue
+        sentences.append(candidate)
+        start = match.end()
+    tail = flat[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return [s for s in sentences if s]
+
+
+def detect_language(text):
+    """
+    Guess the document language
+
+    Returns:
+        tuple: (ISO 639-1 code or "und", confidence between 0 and 1)
+    """
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return "und", 0.0
+
+    script_counts = {}
+    for ch in letters:
+        code_point = ord(ch)
+        for low, high, language in SCRIPT_LANGUAGES:
+            if low <= code_point <= high:
+                script_counts[language] = script_counts.get(language, 0) + 1
+                break
+    if script_counts:
+        language, count = max(script_counts.items(), key=lambda item: item[1])
+        if count / len(letters) > 0.5:
+            return language, round(count / len(letters), 3)
+
+    words = [token.lower() for token in tokenize(text) if token[0].isalpha()]
+    if not words:
+        return "und", 0.0
+    scores = {language: sum(1 for word in words if word in stopwords) for language, stopwords in STOPWORDS.items()}
+    language, hits = max(scores.items(), key=lambda item: item[1])
+    if not hits:
+        return "und", 0.0
+    return language, round(hits / sum(scores.values()), 3)
+
+
+def enrich_text(text):
+    """Build the nlp_ready section for one document"""
+    normalized = normalize_text(text)
+    tokens = tokenize(normalized)
+    language, language_confidence = detect_language(normalized)
+    return {
+        "cleaned_text": ' '.join(normalized.split()),
+        "normalized_text": normalized,
+        "sentences": split_sentences(normalized),
+        "paragraphs": [p.strip() for p in re.split(r'\n\s*\n', text) if p.strip()],
+        "tokens": tokens,
+        "token_count": len(tokens),
+        "language": language,
+        "language_confidence": language_confidence,
+    }
+
+
+def enrich_batch(documents):
+    """
+    Enrich a batch of documents (runs in a worker process)
+
+    Args:
+        documents (list): (document_id, text) pairs
+
+    Returns:
+        list: (document_id, nlp_ready dict) pairs
+    """
+    return [(document_id, enrich_text(text)) for document_id, text in documents]
+
+
+class EnrichmentQueue:
+    """
+    Durable queue of document IDs awaiting enrichment, stored in SQLite.
+
+    Claimed jobs carry a lease; if a worker dies mid-batch the lease expires
+    and the jobs are handed out again.
+    """
+
+    def __init__(self, path=QUEUE_DB, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS enrichment_jobs ("
+            " document_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_until REAL,"
+            " enqueued_at REAL NOT NULL,"
+            " error TEXT)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_enrichment_jobs_status"
+            " ON enrichment_jobs (status, enqueued_at)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def document_lock(self):
+        """
+        Hold the queue database's write lock, shared by every process using the queue.
+
+        Writers of nlp_<id>.json take it so that a save and an enrichment
+        result never overwrite each other.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, document_id):
+        """Queue a document (re-queues it if it was already processed)"""
+        self._connect().execute(
+            "INSERT INTO enrichment_jobs (document_id, status, attempts, enqueued_at)"
+            " VALUES (?, 'pending', 0, ?)"
+            " ON CONFLICT(document_id) DO UPDATE SET status = 'pending', attempts = 0,"
+            " lease_until = NULL, enqueued_at = excluded.enqueued_at, error = NULL",
+            (document_id, time.time()),
+        )
+
+    def claim(self, limit):
+        """Atomically lease up to limit pending (or abandoned) jobs"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT document_id FROM enrichment_jobs"
+                " WHERE status = 'pending' OR (status = 'processing' AND lease_until < ?)"
+                " ORDER BY enqueued_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            ids = [row[0] for row in rows]
+            conn.executemany(
+                "UPDATE enrichment_jobs SET status = 'processing', lease_until = ?,"
+                " attempts = attempts + 1 WHERE document_id = ?",
+                [(now + self.lease_seconds, document_id) for document_id in ids],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return ids
+
+    def complete(self, document_ids):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "UPDATE enrichment_jobs SET status = 'done', lease_until = NULL, error = NULL"
+                " WHERE document_id = ? AND status = 'processing'",
+                [(document_id,) for document_id in document_ids],
+            )
+
+    def fail(self, document_id, error, max_attempts=MAX_ATTEMPTS):
+        """Return a job to the queue, or mark it failed after max_attempts"""
+        self._connect().execute(
+            "UPDATE enrichment_jobs SET lease_until = NULL, error = ?,"
+            " status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END"
+            " WHERE document_id = ?",
+            (str(error), max_attempts, document_id),
+        )
+
+    def stats(self):
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) FROM enrichment_jobs GROUP BY status"
+        ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class EnrichmentWorker:
+    """
+    Claims queued documents in batches and enriches them on a process pool.
+
+    Args:
+        queue (EnrichmentQueue): Queue to consume
+        nlp_dir (str): Directory holding nlp_<id>.json documents
+        batch_size (int): Documents claimed per batch
+        processes (int): Worker processes; each batch is split across them
+            (0 enriches on the worker thread itself)
+        poll_interval (float): Seconds to sleep when the queue is empty
+    """
+
+    def __init__(self, queue, nlp_dir=NLP_DIR, batch_size=BATCH_SIZE, processes=PROCESSES, poll_interval=1.0):
+        self.queue = queue
+        self.nlp_dir = nlp_dir
+        self.batch_size = batch_size
+        self.processes = max(0, processes)
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def _document_path(self, document_id):
+        return os.path.join(self.nlp_dir, f"nlp_{document_id}.json")
+
+    def process_batch(self):
+        """Claim and enrich one batch. Returns the number of documents claimed."""
+        document_ids = self.queue.claim(self.batch_size)
+        if not document_ids:
+            return 0
+
+        documents = []
+        # Timestamp of the save each document's text came from
+        revisions = {}
+        with self.queue.document_lock():
+            for document_id in document_ids:
+                try:
+                    with open(self._document_path(document_id), 'r', encoding='utf-8') as f:
+                        nlp_data = json.load(f)
+                    documents.append((document_id, nlp_data["content"]["raw_text"]))
+                    revisions[document_id] = nlp_data.get("timestamp")
+                except Exception as e:
+                    logging.error(f"Cannot load document {document_id} for enrichment: {e}")
+                    self.queue.fail(document_id, e)
+
+        # One sub-batch per process keeps every core busy with few round trips
+        chunk_size = max(1, -(-len(documents) // max(1, self.processes)))
+        chunks = [documents[i:i + chunk_size] for i in range(0, len(documents), chunk_size)]
+        try:
+            if self._pool is not None:
+                results = [item for chunk in self._pool.map(enrich_batch, chunks) for item in chunk]
+            else:
+                results = enrich_batch(documents)
+        except Exception as e:
+            logging.error(f"Enrichment of batch failed: {e}")
+            for document_id, _ in documents:
+                self.queue.fail(document_id, e)
+            if isinstance(e, BrokenProcessPool):
+                self._stop_pool()
+                self._start_pool()
+            return len(document_ids)
+
+        done = []
+        for document_id, nlp_ready in results:
+            try:
+                if self._write_result(document_id, nlp_ready, revisions[document_id]):
+                    done.append(document_id)
+            except Exception as e:
+                logging.error(f"Failed to write enrichment for {document_id}: {e}")
+                self.queue.fail(document_id, e)
+        self.queue.complete(done)
+        logging.info(f"Enriched {len(done)} of {len(document_ids)} documents")
+        return len(document_ids)
+
+    def _write_result(self, document_id, nlp_ready, revision):
+        """
+        Write an enrichment result into its document unless the document was saved again since.
+
+        Returns False when the result is stale; the newer save has re-queued the document.
+        """
+        path = self._document_path(document_id)
+        with self.queue.document_lock():
+            with open(path, 'r', encoding='utf-8') as f:
+                nlp_data = json.load(f)
+            if nlp_data.get("timestamp") != revision:
+                logging.info(f"Document {document_id} was saved again during enrichment; dropping stale result")
+                return False
+            nlp_data["nlp_ready"] = nlp_ready
+            nlp_data["enrichment_status"] = "enriched"
+            nlp_data["enriched_at"] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            _write_json_atomic(path, nlp_data)
+        return True
+
+    def _start_pool(self):
+        if self.processes > 0 and self._pool is None:
+            # spawn avoids forking a multi-threaded server process
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def _stop_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def run(self, drain=False):
+        """Process batches until stopped (or until the queue is empty when drain=True)"""
+        self._start_pool()
+        try:
+            while not self._stop.is_set():
+                try:
+                    claimed = self.process_batch()
+                except Exception as e:
+                    logging.error(f"Enrichment batch failed: {e}")
+                    claimed = 0
+                if not claimed:
+                    if drain:
+                        break
+                    self._stop.wait(self.poll_interval)
+        finally:
+            self._stop_pool()
+
+    def start(self):
+        """Run the worker on a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="enrichment-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def enqueue_all(queue, nlp_dir=NLP_DIR):
+    """Queue every saved document in nlp_dir (e.g. after changing the enrichment)"""
+    count = 0
+    for path in glob.glob(os.path.join(nlp_dir, "nlp_*.json")):
+        queue.enqueue(os.path.basename(path)[len("nlp_"):-len(".json")])
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run the NLP enrichment worker")
+    parser.add_argument("--drain", action="store_true", help="exit once the queue is empty")
+    parser.add_argument("--enqueue-all", action="store_true", help="queue every saved document first")
+    parser.add_argument("--processes", type=int, default=PROCESSES, help="worker processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="documents per batch")
+    args = parser.parse_args()
+
+    queue = EnrichmentQueue()
+    if args.enqueue_all:
+        logging.info(f"Queued {enqueue_all(queue)} documents")
+    worker = EnrichmentWorker(queue, processes=args.processes, batch_size=args.batch_size)
+    try:
+        worker.run(drain=args.drain)
+    except KeyboardInterrupt:
+        pass
+    logging.info(f"Queue status: {queue.stats()}")
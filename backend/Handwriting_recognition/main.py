@@ -1,20 +1,39 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import uvicorn
+import asyncio
+import math
 import os
+import time
 import uuid
 from datetime import datetime
 import json
 import aiofiles
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
 import shutil
 import base64
 from PIL import Image
 from io import BytesIO
 
-# Set Google Cloud credentials environment variable
-if not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
+import ocr_service
+from ocr_service import multi_ocr_predict
+from state_store import create_state_backend
+from document_pages import count_pages, first_page_image
+from enrichment import INLINE_PROCESSES, EnrichmentQueue, EnrichmentWorker
+from corpus_stats import CorpusStats
+from common.profiling import install_profiling, stage
+from common.blob_store import LocalBlobStore
+from common.upstream import CircuitOpenError, UpstreamError, UpstreamOverloaded, UpstreamTimeout, upstream_metrics
+from common.quota import create_scheduler, QuotaExceeded
+
+def configure_google_credentials():
+    """Set GOOGLE_APPLICATION_CREDENTIALS from a local key file if it is not already set"""
+    if os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
+        return
     # Try to find the credentials file
     possible_paths = [
         'google-cloud-key.json',
@@ -30,9 +49,80 @@ if not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
     else:
         print("WARNING: Google Cloud credentials file not found. OCR may fail.")
 
-from ocr_service import multi_ocr_predict
+# Shared request store (backend selected by REQUEST_STORE_BACKEND), opened at startup
+request_store = None
+
+# Durable queue of saved documents awaiting NLP enrichment, and its in-process worker
+enrichment_queue = None
+enrichment_worker = None
+
+# Running corpus aggregates updated on every save
+corpus_stats = None
+
+# Content-addressed store for uploaded images and documents (BLOB_STORE_DIR).
+# With several replicas it must be a volume they all share, since /api/save
+# may run on a different replica than /api/recognize.
+blob_store = None
+
+# Upload references ("request:<id>") older than this whose request is no
+# longer in the request store (never stored, or expired) are released
+REQUEST_REF_GRACE = float(os.environ.get('REQUEST_REF_GRACE', '3600'))
+BLOB_SWEEP_INTERVAL = float(os.environ.get('BLOB_SWEEP_INTERVAL', '600'))
+
+def sweep_request_refs(now=None):
+    """Release upload references of requests that were never saved or have expired; returns how many"""
+    cutoff = (now if now is not None else time.time()) - REQUEST_REF_GRACE
+    released = 0
+    for digest, ref in blob_store.refs("request:", older_than=cutoff):
+        if request_store.get(ref[len("request:"):]) is None:
+            blob_store.release(digest, ref)
+            released += 1
+    return released
+
+async def sweep_request_refs_periodically():
+    """Run sweep_request_refs every BLOB_SWEEP_INTERVAL seconds"""
+    while True:
+        try:
+            released = await asyncio.to_thread(sweep_request_refs)
+            if released:
+                print(f"Released {released} unsaved upload reference(s)")
+        except Exception as e:
+            print(f"Blob reference sweep failed: {e}")
+        await asyncio.sleep(BLOB_SWEEP_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the request store and enrichment queue and warm the Vision client in the background"""
+    global request_store, enrichment_queue, enrichment_worker, corpus_stats, blob_store
+    configure_google_credentials()
+    request_store = create_state_backend()
+    blob_store = LocalBlobStore(os.environ.get('BLOB_STORE_DIR', 'blobs'))
+    corpus_stats = CorpusStats()
+    enrichment_queue = EnrichmentQueue()
+    # Set ENRICHMENT_INLINE_WORKER=0 when running `python enrichment.py` separately
+    if os.environ.get('ENRICHMENT_INLINE_WORKER', '1') == '1':
+        # Every uvicorn worker runs its own, so the inline pool stays small
+        enrichment_worker = EnrichmentWorker(enrichment_queue, processes=INLINE_PROCESSES)
+        enrichment_worker.start()
+    warmup = asyncio.create_task(asyncio.to_thread(ocr_service.warm_up))
+    sweeper = asyncio.create_task(sweep_request_refs_periodically())
+    yield
+    sweeper.cancel()
+    warmup.cancel()
+    if enrichment_worker is not None:
+        enrichment_worker.stop()
+    enrichment_queue.close()
+    corpus_stats.close()
+    blob_store.close()
+    request_store.close()
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# Uploads are written to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Fair per-user admission to the Vision quota (VISION_QUOTA_PER_MINUTE)
+vision_quota = create_scheduler("vision", per_minute=1800)
 
 # CORS configuration
 origins = [
@@ -48,35 +138,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory store for requests with file backup
-request_store = {}
-REQUEST_STORE_FILE = "request_store_backup.json"
-
-def load_request_store():
-    """Load request store from file if it exists"""
-    global request_store
-    try:
-        if os.path.exists(REQUEST_STORE_FILE):
-            with open(REQUEST_STORE_FILE, 'r') as f:
-                request_store = json.load(f)
-            print(f"Loaded {len(request_store)} requests from backup file")
-        else:
-            print("No backup file found, starting with empty request store")
-    except Exception as e:
-        print(f"Failed to load request store backup: {e}")
-        request_store = {}
-
-def save_request_store():
-    """Save request store to file for persistence"""
-    try:
-        with open(REQUEST_STORE_FILE, 'w') as f:
-            json.dump(request_store, f, indent=2)
-        print(f"Saved {len(request_store)} requests to backup file")
-    except Exception as e:
-        print(f"Failed to save request store backup: {e}")
+# Opt-in sampling profiler and slow-request log (PROFILING_ENABLED=1)
+install_profiling(app)
 
-# Load existing request store on startup
-load_request_store()
+def upstream_http_error(e):
+    """Map a Vision upstream failure to the HTTP error returned to the client"""
+    if isinstance(e, (CircuitOpenError, UpstreamOverloaded)):
+        return HTTPException(status_code=503, detail="OCR service is temporarily unavailable. Please retry shortly.",
+                             headers={"Retry-After": "5"})
+    if isinstance(e, UpstreamTimeout):
+        return HTTPException(status_code=504, detail="OCR service did not respond in time.")
+    return HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
 
 class SaveRequest(BaseModel):
     request_id: str
@@ -86,7 +158,7 @@ class SaveRequest(BaseModel):
 def create_image_preview(image_path):
     """Create a base64 preview of the processed image"""
     try:
-        with Image.open(image_path) as img:
+        with first_page_image(image_path) as img:
             # Convert to RGB if needed
             if img.mode != 'RGB':
                 img = img.convert('RGB')
@@ -104,9 +176,16 @@ def create_image_preview(image_path):
         print(f"Preview generation failed: {e}")
         return None
 
-def save_output(request_id, confirmed_text, original_image_path, original_filename, ocr_result, user_id=None, client_ip=None):
+def save_output(request_id, confirmed_text, original_image_path, original_filename, ocr_result, user_id=None, client_ip=None, image_blob=None):
     """Save the OCR results and user confirmation in NLP-ready format"""
     try:
+        # Fail before writing anything if the upload is not in this replica's blob store
+        if image_blob and not blob_store.exists(image_blob):
+            raise FileNotFoundError(
+                f"Uploaded image {image_blob} is not in the blob store; "
+                "BLOB_STORE_DIR must be shared by all replicas"
+            )
+
         # Create output directory
         output_dir = "output"
         nlp_dir = "nlp_ready"
@@ -125,6 +204,7 @@ def save_output(request_id, confirmed_text, original_image_path, original_filena
                 "client_ip": client_ip,
                 "processing_method": ocr_result.get("method", "Unknown"),
                 "confidence_score": ocr_result.get("confidence", 0.0),
+                "page_count": ocr_result.get("page_count", 1),
                 "methods_tried": ocr_result.get("methods_tried", [])
             },
             "content": {
@@ -138,21 +218,31 @@ def save_output(request_id, confirmed_text, original_image_path, original_filena
             "ocr_details": {
                 "original_ocr_text": ocr_result.get("text", ""),
                 "user_corrections": confirmed_text != ocr_result.get("text", ""),
-                "line_data": ocr_result.get("lines", [])
+                "line_data": ocr_result.get("lines", []),
+                "page_data": ocr_result.get("pages", [])
             },
+            # Sentences, tokens and language are filled in by the enrichment worker
             "nlp_ready": {
-                "cleaned_text": ' '.join(confirmed_text.split()),  # Remove extra whitespace
-                "sentences": [s.strip() for s in confirmed_text.replace('\n', ' ').split('.') if s.strip()],
-                "paragraphs": [p.strip() for p in confirmed_text.split('\n\n') if p.strip()]
+                "cleaned_text": ' '.join(confirmed_text.split())  # Remove extra whitespace
             },
+            "enrichment_status": "pending",
             "status": "approved",
             "ready_for_processing": True
         }
         
-        # Save NLP-ready JSON
+        # Save NLP-ready JSON and hand it to the background enrichment pipeline.
+        # The enrichment worker also writes this file, so both hold the queue's
+        # document lock; re-queuing makes the worker drop any result it is
+        # computing from the previous text.
         nlp_json_path = os.path.join(nlp_dir, f"nlp_{request_id}.json")
-        with open(nlp_json_path, 'w', encoding='utf-8') as f:
-            json.dump(nlp_data, f, indent=2, ensure_ascii=False)
+        if enrichment_queue is not None:
+            with enrichment_queue.document_lock():
+                with open(nlp_json_path, 'w', encoding='utf-8') as f:
+                    json.dump(nlp_data, f, indent=2, ensure_ascii=False)
+                enrichment_queue.enqueue(request_id)
+        else:
+            with open(nlp_json_path, 'w', encoding='utf-8') as f:
+                json.dump(nlp_data, f, indent=2, ensure_ascii=False)
         
         # Save original detailed data
         detailed_data = {
@@ -162,7 +252,8 @@ def save_output(request_id, confirmed_text, original_image_path, original_filena
             "confirmed_text": confirmed_text,
             "ocr_result": ocr_result,
             "user_id": user_id,
-            "client_ip": client_ip
+            "client_ip": client_ip,
+            "image_blob": image_blob
         }
         
         json_path = os.path.join(output_dir, f"{request_id}.json")
@@ -174,41 +265,90 @@ def save_output(request_id, confirmed_text, original_image_path, original_filena
         with open(txt_path, 'w', encoding='utf-8') as f:
             f.write(confirmed_text)
         
-        # Copy the original image to output
-        image_output_path = os.path.join(output_dir, f"{request_id}_{original_filename}")
-        shutil.copy2(original_image_path, image_output_path)
+        if image_blob:
+            # Reference the stored upload instead of copying it; the request's
+            # own reference is handed over to the saved document
+            blob_store.add_ref(image_blob, f"document:{request_id}", {"filename": original_filename})
+            blob_store.release(image_blob, f"request:{request_id}")
+            image_output_path = blob_store.path(image_blob)
+        else:
+            # Requests stored before the blob store existed still point at temp_images
+            image_output_path = os.path.join(output_dir, f"{request_id}_{original_filename}")
+            shutil.copy2(original_image_path, image_output_path)
+        
+        # Update the running corpus statistics
+        if corpus_stats is not None:
+            corpus_stats.record_document(nlp_data)
         
         return {
             "json_file": json_path,
             "nlp_json_file": nlp_json_path,
             "text_file": txt_path,
             "image_file": image_output_path,
+            "image_blob": image_blob,
             "document_id": request_id
         }
         
     except Exception as e:
         raise Exception(f"Failed to save output: {str(e)}")
 
+def quota_key(request: Request):
+    """Vision quota is shared out per client address; the service has no authenticated user"""
+    return request.client.host if request.client else "anonymous"
+
 @app.post("/api/recognize")
-async def recognize(image: UploadFile = File(...)):
+async def recognize(request: Request, image: UploadFile = File(...)):
     request_id = str(uuid.uuid4())
     
-    # Save the uploaded image temporarily
+    # Write the uploaded image (or multi-page PDF/TIFF) to a temp file, in chunks
     temp_dir = "temp_images"
     os.makedirs(temp_dir, exist_ok=True)
     image_path = os.path.join(temp_dir, f"{request_id}_{image.filename}")
     
-    async with aiofiles.open(image_path, 'wb') as out_file:
-        content = await image.read()
-        await out_file.write(content)
+    with stage("save_upload"):
+        async with aiofiles.open(image_path, 'wb') as out_file:
+            while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+                await out_file.write(chunk)
+
+    # Move the upload into the content-addressed store (identical uploads share one copy)
+    with stage("store_blob"):
+        image_blob = await run_in_threadpool(
+            blob_store.put_file, image_path, f"request:{request_id}", {"filename": image.filename}
+        )
+    image_path = blob_store.path(image_blob)
+
+    def discard_upload():
+        """Drop this request's reference when it fails before being stored"""
+        blob_store.release(image_blob, f"request:{request_id}")
+
+    # Reject unreadable documents before spending any Vision quota
+    try:
+        with stage("count_pages"):
+            await run_in_threadpool(count_pages, image_path)
+    except Exception as e:
+        discard_upload()
+        raise HTTPException(status_code=400, detail=f"Could not read uploaded document: {str(e)}")
+
+    # Every page is one Vision call and takes one unit of this user's share of
+    # the Vision quota right before it is sent. A long document is thus queued
+    # page by page between other users' requests instead of draining the
+    # bucket in one go and blocking everyone behind it.
+    loop = asyncio.get_running_loop()
+    client = quota_key(request)
+
+    def acquire_page():
+        with stage("quota_wait"):
+            asyncio.run_coroutine_threadsafe(vision_quota.acquire(client), loop).result()
 
     # Perform OCR
     try:
         # Use the new cloud OCR service
-        ocr_result = multi_ocr_predict(image_path)
+        with stage("ocr"):
+            ocr_result = await run_in_threadpool(multi_ocr_predict, image_path, acquire_page)
         
-        # Create image preview
-        preview_base64 = create_image_preview(image_path)
+        # Create image preview (first page for multi-page documents)
+        with stage("preview"):
+            preview_base64 = await run_in_threadpool(create_image_preview, image_path)
         
         # Convert to the expected format
         formatted_result = {
@@ -217,27 +357,39 @@ async def recognize(image: UploadFile = File(...)):
             "confidence": ocr_result.get("confidence", 0.0),
             "method": ocr_result.get("method", "Cloud-OCR"),
             "methods_tried": ocr_result.get("methods_tried", []),
+            "page_count": ocr_result.get("page_count", 1),
+            "pages": ocr_result.get("pages", []),
             "preview_base64": preview_base64
         }
             
+    except QuotaExceeded as e:
+        discard_upload()
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    except UpstreamError as e:
+        print(f"Vision upstream unavailable: {e}")
+        discard_upload()
+        raise upstream_http_error(e)
     except Exception as e:
         print(f"An error occurred during OCR processing: {e}") # Added for detailed logging
         import traceback
         traceback.print_exc() # Added for full stack trace
+        discard_upload()
         raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
 
     # Store request data
-    request_store[request_id] = {
-        "original_image_path": image_path,
-        "original_filename": image.filename,
-        "ocr_result": formatted_result
-    }
-    
-    # Save request store to file for persistence
-    save_request_store()
+    with stage("request_store_put"):
+        request_store.put(request_id, {
+            "original_image_path": image_path,
+            "original_filename": image.filename,
+            "image_blob": image_blob,
+            "ocr_result": formatted_result
+        })
     
     print(f"Stored request data for ID: {request_id}")
-    print(f"Request store now contains: {list(request_store.keys())}")
 
     return {
         "request_id": request_id,
@@ -246,47 +398,50 @@ async def recognize(image: UploadFile = File(...)):
         "confidence": formatted_result["confidence"],
         "preview_base64": formatted_result.get("preview_base64"),
         "method": formatted_result["method"],
-        "methods_tried": formatted_result.get("methods_tried", [])
+        "methods_tried": formatted_result.get("methods_tried", []),
+        "page_count": formatted_result["page_count"],
+        "pages": formatted_result["pages"]
     }
 
 @app.post("/api/save")
 async def save(request: SaveRequest):
     print(f"=== SAVE REQUEST DEBUG ===")
     print(f"Save request received for ID: {request.request_id}")
-    print(f"Available IDs in request_store: {list(request_store.keys())}")
-    print(f"Request store size: {len(request_store)}")
     print(f"Current working directory: {os.getcwd()}")
     print(f"Confirmed text length: {len(request.confirmed_text)}")
     print(f"User ID: {request.user_id}")
     
-    if request.request_id not in request_store:
+    with stage("request_store_get"):
+        request_data = request_store.get(request.request_id)
+    if request_data is None:
         print(f"ERROR: Request ID {request.request_id} not found in request_store")
-        print(f"Request store contents: {request_store}")
-        raise HTTPException(status_code=404, detail=f"Request ID not found. Available IDs: {list(request_store.keys())}")
+        raise HTTPException(status_code=404, detail="Request ID not found or expired.")
 
-    request_data = request_store[request.request_id]
     print(f"Found request data for ID: {request.request_id}")
     print(f"Original image path: {request_data['original_image_path']}")
     print(f"Original filename: {request_data['original_filename']}")
     
     try:
         print(f"Attempting to save output...")
-        saved_files = save_output(
-            request_id=request.request_id,
-            confirmed_text=request.confirmed_text,
-            original_image_path=request_data["original_image_path"],
-            original_filename=request_data["original_filename"],
-            ocr_result=request_data["ocr_result"],
-            user_id=request.user_id,
-            client_ip="127.0.0.1" # Placeholder
-        )
+        with stage("save_output"):
+            saved_files = await run_in_threadpool(
+                save_output,
+                request_id=request.request_id,
+                confirmed_text=request.confirmed_text,
+                original_image_path=request_data["original_image_path"],
+                original_filename=request_data["original_filename"],
+                ocr_result=request_data["ocr_result"],
+                user_id=request.user_id,
+                client_ip="127.0.0.1", # Placeholder
+                image_blob=request_data.get("image_blob")
+            )
         
         print(f"Successfully saved files: {saved_files}")
         print(f"=== SAVE REQUEST SUCCESS ===")
         
         # Clean up temp file and request store entry
         # os.remove(request_data["original_image_path"])
-        # del request_store[request.request_id]
+        # request_store.delete(request.request_id)
 
         return {
             "message": "Data saved successfully.",
@@ -305,15 +460,50 @@ async def save(request: SaveRequest):
 def read_root():
     return {"message": "Handwriting Recognition API is running."}
 
+@app.get("/healthz")
+def healthz():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness probe: the request store is open and the Vision client is warm"""
+    checks = {
+        "request_store": request_store is not None,
+        "vision_client": ocr_service.is_client_ready(),
+    }
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "starting", "checks": checks}
+    )
+
+@app.get("/api/stats")
+def stats(day: Optional[str] = None, user_id: Optional[str] = None, group_by: Optional[str] = None):
+    """Corpus statistics for a day (YYYY-MM-DD) and/or user, or broken down by day or user"""
+    if group_by is None:
+        return corpus_stats.get(day=day, user_id=user_id)
+    if group_by not in ("day", "user"):
+        raise HTTPException(status_code=400, detail="group_by must be 'day' or 'user'")
+    return corpus_stats.breakdown(group_by, day=day, user_id=user_id)
+
+@app.get("/api/usage")
+def usage(request: Request):
+    """The caller's Vision quota usage counters"""
+    return vision_quota.usage(quota_key(request))
+
 @app.get("/api/debug")
 def debug_info():
     """Debug endpoint to check server status"""
     return {
         "server_status": "running",
+        "request_store_backend": type(request_store).__name__,
         "request_store_size": len(request_store),
-        "request_ids": list(request_store.keys()),
+        "request_ids": request_store.keys(),
         "google_credentials_set": bool(os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')),
-        "credentials_path": os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', 'Not set')
+        "credentials_path": os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', 'Not set'),
+        "upstreams": upstream_metrics(),
+        "enrichment_queue": enrichment_queue.stats() if enrichment_queue else {}
     }
 
 if __name__ == "__main__":
@@ -5,35 +5,86 @@ This module provides handwriting recognition using Google Cloud Vision API only.
 
 import logging
 import os
-from google.cloud import vision
 import io
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from document_pages import detect_document_type, iter_document_pages
+from common.upstream import UpstreamError, get_upstream, is_transient
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+# The Vision SDK is slow to import, so the client is created on first use
+# (or by warm_up() in the background at startup) rather than at import time.
+_vision_client = None
+_client_lock = threading.Lock()
+
+# Deadline, retry and circuit-breaker policy for Vision calls
+vision_upstream = get_upstream("vision", timeout=30.0, max_attempts=3)
+
+# Pages of a multi-page document OCR'd at the same time
+PAGE_CONCURRENCY = int(os.environ.get('OCR_PAGE_CONCURRENCY', '4'))
+
+
+def get_vision_client():
+    """Return the shared Google Cloud Vision client, creating it on first use"""
+    global _vision_client
+    if _vision_client is None:
+        with _client_lock:
+            if _vision_client is None:
+                from google.cloud import vision
+                _vision_client = vision.ImageAnnotatorClient()
+    return _vision_client
 
-def google_cloud_vision_ocr(image_path):
+
+def is_client_ready():
+    """Whether the Vision client has been created"""
+    return _vision_client is not None
+
+
+def warm_up():
+    """Import the Vision SDK and create the client ahead of the first request"""
+    try:
+        get_vision_client()
+        logging.info("Google Cloud Vision client is ready")
+    except Exception as e:
+        logging.error(f"Google Cloud Vision client warm-up failed: {e}")
+
+
+def google_cloud_vision_ocr(image_path, content=None):
     """
     Extract handwritten text using Google Cloud Vision API
     
     Args:
         image_path (str): Path to the image file
+        content (bytes): Image bytes to use instead of reading image_path
         
     Returns:
         dict: OCR result containing text, confidence, words, and error information
+        
+    Raises:
+        UpstreamError: Vision was unavailable (circuit open, shed or timed out)
+        Exception: a transient Vision error persisted through every retry
     """
     try:
-        # Initialize the Google Cloud Vision client
-        client = vision.ImageAnnotatorClient()
+        from google.cloud import vision
+
+        # Reuse the shared Google Cloud Vision client
+        client = get_vision_client()
         
         # Load the image file
-        with io.open(image_path, 'rb') as image_file:
-            content = image_file.read()
+        if content is None:
+            with io.open(image_path, 'rb') as image_file:
+                content = image_file.read()
         
         image = vision.Image(content=content)
         
-        # Use document text detection for handwriting
-        response = client.document_text_detection(image=image)
+        # Use document text detection for handwriting (read-only, safe to retry)
+        response = vision_upstream.call(
+            client.document_text_detection, image=image, timeout=vision_upstream.timeout
+        )
         
         # Check for errors in the response
         if response.error.message:
@@ -78,6 +129,9 @@ def google_cloud_vision_ocr(image_path):
             }
             
     except Exception as e:
+        # Outages are surfaced to the caller instead of looking like an empty page
+        if isinstance(e, UpstreamError) or is_transient(e):
+            raise
         error_msg = f"Google Cloud Vision API error: {str(e)}"
         logging.error(error_msg)
         return {
@@ -89,21 +143,110 @@ def google_cloud_vision_ocr(image_path):
         }
 
 
-def multi_ocr_predict(image_path):
+def multi_page_ocr_predict(document_path, max_workers=None, acquire_page=None):
+    """
+    OCR every page of a multi-page PDF or TIFF with bounded parallelism
+    
+    Pages are rendered lazily and at most max_workers of them are held in
+    memory or in flight at any time. Results are collected in page order.
+    
+    Args:
+        document_path (str): Path to the PDF or TIFF file
+        max_workers (int): Pages OCR'd concurrently (default OCR_PAGE_CONCURRENCY)
+        acquire_page (callable): Called before each page's Vision call, e.g. to
+            take one unit of the Vision quota; an exception stops the document
+        
+    Returns:
+        dict: Combined OCR result with per-page text, lines and confidence
+    """
+    max_workers = max_workers or PAGE_CONCURRENCY
+    logging.info(f"Processing multi-page document: {document_path}")
+    
+    pages = []
+    in_flight = deque()
+    
+    def collect_oldest():
+        page_number, future = in_flight.popleft()
+        page_result = future.result()
+        text = page_result["text"]
+        pages.append({
+            "page": page_number,
+            "text": text,
+            "confidence": page_result["confidence"],
+            "lines": [{"line": text, "confidence": page_result["confidence"], "page": page_number}] if text else [],
+            "error": page_result["error"]
+        })
+    
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr-page") as pool:
+        for page_number, content in iter_document_pages(document_path):
+            if acquire_page:
+                acquire_page()
+            in_flight.append((page_number, pool.submit(google_cloud_vision_ocr, document_path, content)))
+            if len(in_flight) >= max_workers:
+                collect_oldest()
+        while in_flight:
+            collect_oldest()
+    
+    recognized = [page for page in pages if page["text"]]
+    if not recognized:
+        errors = [page["error"] for page in pages if page["error"]]
+        error_msg = errors[0] if errors else "No pages found in document"
+        logging.error(f"Google Cloud Vision failed on every page: {error_msg}")
+        return {
+            "text": "",
+            "raw_text": "",
+            "corrected_text": "",
+            "confidence": 0.0,
+            "method": "Failed",
+            "ocr_engine": "Google Cloud Vision",
+            "methods_tried": ["Google Cloud Vision API (failed)"],
+            "error": f"OCR failed: {error_msg}",
+            "page_count": len(pages),
+            "pages": pages,
+            "lines": []
+        }
+    
+    full_text = "\n\n".join(page["text"] for page in recognized)
+    confidence = sum(page["confidence"] for page in recognized) / len(recognized)
+    logging.info(f"Extracted text from {len(recognized)} of {len(pages)} pages")
+    
+    return {
+        "text": full_text,
+        "raw_text": full_text,
+        "corrected_text": full_text,
+        "confidence": confidence,
+        "method": "Google Cloud Vision API",
+        "ocr_engine": "Google Cloud Vision",
+        "methods_tried": ["Google Cloud Vision API"],
+        "primary_method": "Google Cloud Vision",
+        "page_count": len(pages),
+        "pages": pages,
+        "lines": [line for page in pages for line in page["lines"]]
+    }
+
+
+def multi_ocr_predict(image_path, acquire_page=None):
     """
     Main OCR prediction function using Google Cloud Vision API
     
     Args:
         image_path (str): Path to the image file
+        acquire_page (callable): Called before each page's Vision call
         
     Returns:
         dict: Comprehensive OCR result with text, confidence, and metadata
     """
     
+    # Multi-page scans are split and OCR'd page by page
+    if detect_document_type(image_path) != "image":
+        return multi_page_ocr_predict(image_path, acquire_page=acquire_page)
+    
     # Use Google Cloud Vision API
     logging.info(f"Processing image: {image_path}")
     logging.info("Using Google Cloud Vision API for handwriting recognition...")
     
+    if acquire_page:
+        acquire_page()
     gcp_result = google_cloud_vision_ocr(image_path)
     
     # Check if Google Cloud Vision succeeded
@@ -0,0 +1,309 @@
+"""
+Request state backends for the OCR service.
+This module keeps the per-request OCR state shared between /api/recognize and
+/api/save, so the service can run several uvicorn workers or replicas.
+
+Backends:
+    memory  - in-process dict with the legacy JSON backup file (single worker)
+    sqlite  - shared on-disk store for all workers on one host
+    redis   - network key-value store for multiple hosts
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# Marker of the backup file layout that stores expiry times next to the entries
+BACKUP_FORMAT = 2
+
+# Lifetime of a request entry when REQUEST_STORE_TTL is unset: requests that
+# are recognised but never saved must not be kept forever
+DEFAULT_REQUEST_TTL = 24 * 3600
+
+
+class StateBackend(ABC):
+    """
+    Interface for request state storage.
+
+    Values are JSON-serialisable dicts. Every operation is atomic per key and
+    entries expire after their TTL (seconds); a TTL of None keeps them forever.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """Return the value stored under key, or None if missing or expired"""
+
+    @abstractmethod
+    def put(self, key, value, ttl=None):
+        """Store value under key; ttl overrides the backend's default TTL"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove key. Returns True if it existed."""
+
+    @abstractmethod
+    def keys(self):
+        """Keys of all live entries"""
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.keys())
+
+    def close(self):
+        pass
+
+
+class InMemoryStateBackend(StateBackend):
+    """In-process store, optionally mirrored to a JSON backup file."""
+
+    def __init__(self, backup_file=None, default_ttl=None):
+        self.backup_file = backup_file
+        self.default_ttl = default_ttl
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._load_backup()
+
+    def _load_backup(self):
+        """Load entries and their expiry times from the backup file if it exists"""
+        if not self.backup_file:
+            return
+        try:
+            if os.path.exists(self.backup_file):
+                with open(self.backup_file, 'r') as f:
+                    backup = json.load(f)
+                if backup.get("_format") == BACKUP_FORMAT:
+                    self._data = backup.get("entries", {})
+                    self._expires = {k: float(v) for k, v in backup.get("expires", {}).items() if k in self._data}
+                else:
+                    # Legacy backups are a plain {key: value} dict without expiry times
+                    self._data = backup
+                    self._expires = {}
+                if self.default_ttl is not None:
+                    # Entries saved without an expiry get a full TTL from now
+                    expires_at = time.time() + self.default_ttl
+                    for key in self._data:
+                        self._expires.setdefault(key, expires_at)
+                self._purge_expired(time.time())
+                logging.info(f"Loaded {len(self._data)} requests from backup file")
+            else:
+                logging.info("No backup file found, starting with empty request store")
+        except Exception as e:
+            logging.error(f"Failed to load request store backup: {e}")
+            self._data = {}
+            self._expires = {}
+
+    def _save_backup(self):
+        """Save entries and their expiry times to the backup file for persistence"""
+        if not self.backup_file:
+            return
+        try:
+            with open(self.backup_file, 'w') as f:
+                json.dump({"_format": BACKUP_FORMAT, "entries": self._data, "expires": self._expires}, f, indent=2)
+        except Exception as e:
+            logging.error(f"Failed to save request store backup: {e}")
+
+    def _purge_expired(self, now):
+        expired = [k for k, exp in self._expires.items() if exp <= now]
+        for key in expired:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return bool(expired)
+
+    def get(self, key):
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is not None and expires <= time.time():
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+                return None
+            return self._data.get(key)
+
+    def put(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        with self._lock:
+            self._purge_expired(time.time())
+            self._data[key] = value
+            if ttl is not None:
+                self._expires[key] = time.time() + ttl
+            else:
+                self._expires.pop(key, None)
+            self._save_backup()
+
+    def delete(self, key):
+        with self._lock:
+            existed = self._data.pop(key, None) is not None
+            self._expires.pop(key, None)
+            if existed:
+                self._save_backup()
+            return existed
+
+    def keys(self):
+        with self._lock:
+            if self._purge_expired(time.time()):
+                self._save_backup()
+            return list(self._data.keys())
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Shared on-disk store backed by SQLite in WAL mode.
+
+    Every worker process opens the same database file; SQLite serialises
+    writers, so put/delete are atomic across processes on the same host.
+    """
+
+    def __init__(self, path, default_ttl=None, busy_timeout=5.0):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS request_state ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_request_state_expires"
+            " ON request_state (expires_at)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM request_state"
+            " WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM request_state WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (now,),
+            )
+            conn.execute(
+                "INSERT INTO request_state (key, value, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value,"
+                " expires_at = excluded.expires_at",
+                (key, json.dumps(value), expires_at),
+            )
+
+    def delete(self, key):
+        conn = self._connect()
+        with conn:
+            cur = conn.execute("DELETE FROM request_state WHERE key = ?", (key,))
+        return cur.rowcount > 0
+
+    def keys(self):
+        rows = self._connect().execute(
+            "SELECT key FROM request_state WHERE expires_at IS NULL OR expires_at > ?",
+            (time.time(),),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM request_state WHERE expires_at IS NULL OR expires_at > ?",
+            (time.time(),),
+        ).fetchone()
+        return row[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Network key-value store backed by Redis.
+
+    Any client exposing the redis-py API (get/set/delete/scan_iter) can be
+    passed in, e.g. fakeredis for local testing.
+    """
+
+    def __init__(self, url=None, client=None, prefix="ocr:request:", default_ttl=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def put(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        # Millisecond precision, so fractional TTLs are neither truncated nor rejected as 0
+        self.client.set(self._key(key), json.dumps(value), px=max(1, int(ttl * 1000)) if ttl else None)
+
+    def delete(self, key):
+        return bool(self.client.delete(self._key(key)))
+
+    def keys(self):
+        keys = []
+        for raw in self.client.scan_iter(match=f"{self.prefix}*"):
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8')
+            keys.append(raw[len(self.prefix):])
+        return keys
+
+    def close(self):
+        close = getattr(self.client, "close", None)
+        if close:
+            close()
+
+
+def create_state_backend(kind=None, **kwargs):
+    """
+    Build the request state backend selected by REQUEST_STORE_BACKEND.
+
+    Environment:
+        REQUEST_STORE_BACKEND  memory (default), sqlite or redis
+        REQUEST_STORE_FILE     JSON backup file for the memory backend
+        REQUEST_STORE_DB       database file for the sqlite backend
+        REQUEST_STORE_URL      redis URL for the redis backend
+        REQUEST_STORE_TTL      entry lifetime in seconds (default 24h, 0 = no expiry)
+    """
+    kind = (kind or os.environ.get('REQUEST_STORE_BACKEND', 'memory')).lower()
+    ttl = float(os.environ.get('REQUEST_STORE_TTL') or DEFAULT_REQUEST_TTL)
+    kwargs.setdefault('default_ttl', ttl if ttl > 0 else None)
+
+    if kind == 'memory':
+        kwargs.setdefault('backup_file', os.environ.get('REQUEST_STORE_FILE', 'request_store_backup.json'))
+        return InMemoryStateBackend(**kwargs)
+    if kind == 'sqlite':
+        kwargs.setdefault('path', os.environ.get('REQUEST_STORE_DB', 'request_store.db'))
+        return SQLiteStateBackend(**kwargs)
+    if kind == 'redis':
+        kwargs.setdefault('url', os.environ.get('REQUEST_STORE_URL', 'redis://localhost:6379/0'))
+        return RedisStateBackend(**kwargs)
+    raise ValueError(f"Unknown request store backend: {kind}")
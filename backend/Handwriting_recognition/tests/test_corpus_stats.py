@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from corpus_stats import CorpusStats
+
+
+@pytest.fixture
+def stats(tmp_path):
+    store = CorpusStats(str(tmp_path / "stats.db"))
+    yield store
+    store.close()
+
+
+def record(stats, document_id, day="2026-01-01", user_id="alice", words=10, corrected=False, confidence=0.9):
+    stats.record(document_id, day, user_id, words=words, characters=words * 5,
+                 corrected=corrected, confidence=confidence)
+
+
+def test_rollups_by_day_user_and_overall(stats):
+    record(stats, "a", user_id="alice", words=10, corrected=True)
+    record(stats, "b", user_id="bob", words=20)
+    record(stats, "c", day="2026-01-02", user_id="alice", words=30)
+
+    overall = stats.get()
+    assert (overall["day"], overall["user_id"]) == (None, None)
+    assert overall["documents"] == 3
+    assert overall["total_words"] == 60
+    assert overall["corrected_documents"] == 1
+    assert stats.get(day="2026-01-01")["documents"] == 2
+    assert stats.get(user_id="alice")["total_words"] == 40
+    assert stats.get(day="2026-01-01", user_id="bob")["total_words"] == 20
+    assert stats.get(day="2026-01-03")["documents"] == 0
+
+
+def test_re_recording_replaces_contribution(stats):
+    record(stats, "a", user_id="alice", words=10)
+    record(stats, "a", user_id="bob", words=15)
+
+    assert stats.get()["documents"] == 1
+    assert stats.get(user_id="alice")["documents"] == 0
+    assert stats.get(user_id="bob")["total_words"] == 15
+
+
+def test_breakdowns(stats):
+    record(stats, "a", user_id="alice")
+    record(stats, "b", user_id="bob")
+    record(stats, "c", day="2026-01-02", user_id="alice")
+
+    assert [(row["day"], row["documents"]) for row in stats.breakdown("day")] == [
+        ("2026-01-01", 2), ("2026-01-02", 1)
+    ]
+    assert [(row["user_id"], row["documents"]) for row in stats.breakdown("user")] == [
+        ("alice", 2), ("bob", 1)
+    ]
+    assert [row["day"] for row in stats.breakdown("day", user_id="bob")] == ["2026-01-01"]
+    assert [row["user_id"] for row in stats.breakdown("user", day="2026-01-02")] == ["alice"]
+    with pytest.raises(ValueError):
+        stats.breakdown("month")
+
+
+def test_user_ids_that_look_like_wildcards_are_ordinary_users(stats):
+    record(stats, "a", user_id="*", words=10)
+    record(stats, "b", user_id="all", words=20)
+
+    assert stats.get()["documents"] == 2
+    assert stats.get()["total_words"] == 30
+    assert stats.get(user_id="*")["total_words"] == 10
+    assert stats.get(day="2026-01-01")["documents"] == 2
+    assert sorted(row["user_id"] for row in stats.breakdown("user")) == ["*", "all"]
+
+
+def test_rebuild_from_saved_documents(stats, tmp_path):
+    nlp_dir = tmp_path / "nlp_ready"
+    nlp_dir.mkdir()
+    for document_id, user_id in (("a", "alice"), ("b", None)):
+        (nlp_dir / f"nlp_{document_id}.json").write_text(json.dumps({
+            "document_id": document_id,
+            "timestamp": "2026-01-05T10:00:00",
+            "metadata": {"user_id": user_id, "confidence_score": 0.5},
+            "content": {"word_count": 4, "character_count": 20},
+            "ocr_details": {"user_corrections": True},
+        }))
+    (nlp_dir / "nlp_broken.json").write_text("{")
+    record(stats, "stale")
+
+    assert stats.rebuild(str(nlp_dir)) == 2
+    assert stats.get()["documents"] == 2
+    assert stats.get(user_id="anonymous")["documents"] == 1
+    assert stats.get(day="2026-01-05")["correction_rate"] == 1.0
@@ -0,0 +1,103 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import document_pages
+from document_pages import count_pages, detect_document_type, first_page_image, iter_document_pages
+
+
+def make_pdf(path, pages):
+    pdfium = pytest.importorskip("pypdfium2")
+    pdf = pdfium.PdfDocument.new()
+    for _ in range(pages):
+        pdf.new_page(200, 300)
+    pdf.save(str(path))
+    pdf.close()
+    return str(path)
+
+
+def make_tiff(path, pages):
+    frames = [Image.new("L", (40, 30), color=i * 40) for i in range(pages)]
+    frames[0].save(str(path), save_all=True, append_images=frames[1:])
+    return str(path)
+
+
+def test_detect_document_type(tmp_path):
+    png = tmp_path / "page.png"
+    Image.new("RGB", (10, 10)).save(png)
+    assert detect_document_type(str(png)) == "image"
+    assert detect_document_type(make_tiff(tmp_path / "scan.tif", 2)) == "tiff"
+    assert detect_document_type(make_pdf(tmp_path / "scan.pdf", 1)) == "pdf"
+
+
+def test_tiff_pages_are_split(tmp_path):
+    path = make_tiff(tmp_path / "scan.tif", 3)
+    assert count_pages(path) == 3
+    pages = list(iter_document_pages(path))
+    assert [number for number, _ in pages] == [1, 2, 3]
+    assert all(content.startswith(b"\x89PNG") for _, content in pages)
+
+
+def test_pdf_pages_are_rendered(tmp_path):
+    path = make_pdf(tmp_path / "scan.pdf", 3)
+    assert count_pages(path) == 3
+    pages = list(iter_document_pages(path, dpi=72))
+    assert [number for number, _ in pages] == [1, 2, 3]
+    assert Image.open(io.BytesIO(pages[0][1])).size == (200, 300)
+    with first_page_image(path) as img:
+        assert img.size == (200, 300)
+
+
+def test_concurrent_pdf_uploads(tmp_path):
+    paths = [make_pdf(tmp_path / f"scan{i}.pdf", 4) for i in range(4)]
+
+    def process(path):
+        return count_pages(path), len(list(iter_document_pages(path, dpi=36)))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(process, paths * 4))
+    assert results == [(4, 4)] * 16
+
+
+class LockCheckingPdf:
+    """Fake pypdfium2 document that fails if it is used without the pdfium lock"""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def _check(self):
+        assert document_pages._pdfium_lock.locked(), "pdfium called without the lock"
+
+    def __len__(self):
+        self._check()
+        return self.pages
+
+    def __getitem__(self, index):
+        self._check()
+        return self
+
+    def render(self, scale):
+        self._check()
+        return self
+
+    def to_pil(self):
+        self._check()
+        return Image.new("RGB", (20, 20))
+
+    def close(self):
+        self._check()
+
+
+def test_every_pdfium_call_holds_the_lock(tmp_path, monkeypatch):
+    path = tmp_path / "fake.pdf"
+    path.write_bytes(b"%PDF-1.4\n")
+    monkeypatch.setattr(document_pages, "_open_pdf", lambda _: LockCheckingPdf(2))
+    assert count_pages(str(path)) == 2
+    pages = iter_document_pages(str(path))
+    number, _ = next(pages)
+    # The lock is released while the caller works on a yielded page
+    assert number == 1 and not document_pages._pdfium_lock.locked()
+    assert len(list(pages)) == 1
@@ -0,0 +1,117 @@
+import json
+import os
+
+import pytest
+
+import enrichment
+from enrichment import (
+    EnrichmentQueue, EnrichmentWorker, detect_language, enqueue_all, split_sentences, tokenize,
+)
+
+
+def test_tokenize_and_sentences():
+    assert tokenize("Don't stop, well-known fox!") == ["Don't", "stop", ",", "well-known", "fox", "!"]
+    text = "Dr. Smith met J. Doe in town. They talked! Did it rain?"
+    assert split_sentences(text) == ["Dr. Smith met J. Doe in town.", "They talked!", "Did it rain?"]
+
+
+def test_detect_language():
+    assert detect_language("The lion laughed at the mouse and let him go.")[0] == "en"
+    assert detect_language("नमस्ते दुनिया")[0] == "hi"
+    assert detect_language("1234 ...") == ("und", 0.0)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = EnrichmentQueue(str(tmp_path / "queue.db"))
+    yield queue
+    queue.close()
+
+
+def save_document(nlp_dir, queue, document_id, text, timestamp):
+    """What save_output() does: write the document under the lock and (re-)queue it"""
+    os.makedirs(nlp_dir, exist_ok=True)
+    with queue.document_lock():
+        with open(os.path.join(nlp_dir, f"nlp_{document_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                "document_id": document_id,
+                "timestamp": timestamp,
+                "content": {"raw_text": text},
+                "nlp_ready": {"cleaned_text": text},
+                "enrichment_status": "pending",
+            }, f)
+        queue.enqueue(document_id)
+
+
+def load_document(nlp_dir, document_id):
+    with open(os.path.join(nlp_dir, f"nlp_{document_id}.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_queue_claim_complete_and_fail(queue):
+    for document_id in ("a", "b", "c"):
+        queue.enqueue(document_id)
+    assert queue.claim(2) == ["a", "b"]
+    queue.complete(["a"])
+    queue.fail("b", "boom", max_attempts=1)
+    assert queue.stats() == {"done": 1, "failed": 1, "pending": 1}
+
+
+def test_expired_leases_are_reclaimed(tmp_path):
+    queue = EnrichmentQueue(str(tmp_path / "queue.db"), lease_seconds=-1)
+    queue.enqueue("a")
+    assert queue.claim(10) == ["a"]
+    # The lease has already expired, as if the worker had died mid-batch
+    assert queue.claim(10) == ["a"]
+    queue.close()
+
+
+def test_worker_enriches_documents(tmp_path, queue):
+    nlp_dir = str(tmp_path / "nlp_ready")
+    save_document(nlp_dir, queue, "doc", "The fox ran. It was fast.", "2025-01-01T00:00:00")
+    worker = EnrichmentWorker(queue, nlp_dir=nlp_dir, processes=0)
+    assert worker.process_batch() == 1
+
+    document = load_document(nlp_dir, "doc")
+    assert document["enrichment_status"] == "enriched"
+    assert document["nlp_ready"]["sentences"] == ["The fox ran.", "It was fast."]
+    assert document["nlp_ready"]["language"] == "en"
+    assert queue.stats() == {"done": 1}
+
+
+def test_save_during_enrichment_wins(tmp_path, queue, monkeypatch):
+    nlp_dir = str(tmp_path / "nlp_ready")
+    save_document(nlp_dir, queue, "doc", "Old text.", "2025-01-01T00:00:00")
+    original_enrich_batch = enrichment.enrich_batch
+
+    def enrich_while_user_resaves(documents):
+        results = original_enrich_batch(documents)
+        save_document(nlp_dir, queue, "doc", "New corrected text.", "2025-01-01T00:05:00")
+        return results
+
+    monkeypatch.setattr(enrichment, "enrich_batch", enrich_while_user_resaves)
+    worker = EnrichmentWorker(queue, nlp_dir=nlp_dir, processes=0)
+    worker.process_batch()
+
+    # The stale result was dropped and the re-save left the document queued
+    document = load_document(nlp_dir, "doc")
+    assert document["content"]["raw_text"] == "New corrected text."
+    assert document["enrichment_status"] == "pending"
+    assert queue.stats() == {"pending": 1}
+
+    monkeypatch.setattr(enrichment, "enrich_batch", original_enrich_batch)
+    worker.process_batch()
+    document = load_document(nlp_dir, "doc")
+    assert document["nlp_ready"]["normalized_text"] == "New corrected text."
+    assert queue.stats() == {"done": 1}
+
+
+def test_worker_uses_process_pool(tmp_path, queue):
+    nlp_dir = str(tmp_path / "nlp_ready")
+    for i in range(4):
+        save_document(nlp_dir, queue, f"doc{i}", f"Document number {i}.", "2025-01-01T00:00:00")
+    enqueue_all(queue, nlp_dir)
+    worker = EnrichmentWorker(queue, nlp_dir=nlp_dir, processes=2, poll_interval=0.01)
+    worker.run(drain=True)
+    assert queue.stats() == {"done": 4}
+    assert load_document(nlp_dir, "doc3")["nlp_ready"]["token_count"] == 4
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("PIL")
+
+import ocr_service
+from common.quota import FairScheduler, QuotaExceeded
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """A fake three-page document whose Vision calls are recorded in order"""
+    events = []
+    lock = threading.Lock()
+
+    def fake_pages(path):
+        for number in (1, 2, 3):
+            yield number, f"page-{number}".encode()
+
+    def fake_ocr(path, content=None):
+        with lock:
+            events.append(("ocr", content.decode()))
+        return {"text": content.decode(), "confidence": 0.9, "error": None}
+
+    monkeypatch.setattr(ocr_service, "detect_document_type", lambda path: "pdf")
+    monkeypatch.setattr(ocr_service, "iter_document_pages", fake_pages)
+    monkeypatch.setattr(ocr_service, "google_cloud_vision_ocr", fake_ocr)
+    return events
+
+
+def test_each_page_acquires_before_its_vision_call(pages):
+    def acquire_page():
+        pages.append(("acquire", None))
+
+    result = ocr_service.multi_ocr_predict("doc.pdf", acquire_page=acquire_page)
+    assert result["page_count"] == 3
+    for i, (kind, _) in enumerate(pages):
+        if kind == "ocr":
+            acquired = sum(1 for k, _ in pages[:i] if k == "acquire")
+            called = sum(1 for k, _ in pages[:i] if k == "ocr")
+            assert acquired > called
+
+
+def test_quota_rejection_stops_the_document(pages):
+    acquired = []
+
+    def acquire_page():
+        if len(acquired) == 2:
+            raise QuotaExceeded("saturated")
+        acquired.append(True)
+
+    with pytest.raises(QuotaExceeded):
+        ocr_service.multi_ocr_predict("doc.pdf", acquire_page=acquire_page)
+    assert sorted(content for _, content in pages) == ["page-1", "page-2"]
+
+
+def test_large_document_does_not_block_other_clients():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        scheduler = FairScheduler("vision", rate=200.0, burst=5, max_wait=2.0)
+
+        def large_document():
+            # As /api/recognize does: one quota unit per page, from the OCR thread
+            for _ in range(400):
+                asyncio.run_coroutine_threadsafe(scheduler.acquire("large"), loop).result()
+
+        document = loop.run_in_executor(None, large_document)
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        await scheduler.acquire("small")
+        waited = time.monotonic() - started
+        await document
+        return waited
+
+    assert asyncio.run(scenario()) < 0.5
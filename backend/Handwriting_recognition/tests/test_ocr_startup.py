@@ -0,0 +1,6 @@
+def test_import_is_fast_and_defers_the_vision_sdk(profile_import, import_time_budget_ms, tmp_path):
+    elapsed_ms, imported = profile_import(
+        "Handwriting_recognition", requires=("fastapi", "aiofiles", "PIL"), cwd=str(tmp_path)
+    )
+    assert "google.cloud.vision" not in imported
+    assert elapsed_ms < import_time_budget_ms, f"import main took {elapsed_ms:.0f}ms"
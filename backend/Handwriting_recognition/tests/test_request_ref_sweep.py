@@ -0,0 +1,71 @@
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("aiofiles")
+
+from common.blob_store import LocalBlobStore
+from state_store import InMemoryStateBackend
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    # Loaded by path: every service has a main.py
+    monkeypatch.chdir(tmp_path)
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+    spec = importlib.util.spec_from_file_location("ocr_main", path)
+    main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main)
+    blob_store = LocalBlobStore(str(tmp_path / "blobs"))
+    monkeypatch.setattr(main, "blob_store", blob_store)
+    monkeypatch.setattr(main, "request_store", InMemoryStateBackend())
+    monkeypatch.setattr(main, "REQUEST_REF_GRACE", 60.0)
+    yield main
+    blob_store.close()
+
+
+def test_sweep_releases_only_old_refs_without_a_stored_request(main):
+    stored = main.blob_store.put(b"stored", "request:stored")
+    main.request_store.put("stored", {"image_blob": stored})
+    abandoned = main.blob_store.put(b"abandoned", "request:abandoned")
+    saved = main.blob_store.put(b"saved", "document:saved")
+    shared = main.blob_store.put(b"abandoned", "document:other")
+    assert shared == abandoned
+
+    # Nothing is old enough yet: the request may still be in flight
+    assert main.sweep_request_refs() == 0
+
+    assert main.sweep_request_refs(now=main.time.time() + 120) == 1
+    assert main.blob_store.refcount(stored) == 1
+    assert main.blob_store.refcount(saved) == 1
+    # The abandoned upload's reference is gone, the document sharing its content keeps it
+    assert main.blob_store.refs("request:") == [(stored, "request:stored")]
+    assert main.blob_store.exists(abandoned)
+
+    main.request_store.delete("stored")
+    assert main.sweep_request_refs(now=main.time.time() + 120) == 1
+    assert not main.blob_store.exists(stored)
+
+
+def save(main, request_id, image_blob):
+    return main.save_output(
+        request_id=request_id, confirmed_text="hello world", original_image_path=None,
+        original_filename="scan.png", ocr_result={"text": "hello world"}, image_blob=image_blob,
+    )
+
+
+def test_save_hands_the_upload_reference_to_the_document(main):
+    digest = main.blob_store.put(b"scan", "request:r1")
+    saved = save(main, "r1", digest)
+    assert saved["image_file"] == main.blob_store.path(digest)
+    assert main.blob_store.refs() == [(digest, "document:r1")]
+
+
+def test_save_fails_when_the_upload_is_not_in_this_blob_store(main):
+    # e.g. /api/recognize ran on a replica with its own BLOB_STORE_DIR
+    with pytest.raises(Exception, match="BLOB_STORE_DIR"):
+        save(main, "r2", "0" * 64)
+    assert not os.path.exists("nlp_ready/nlp_r2.json")
+    assert main.blob_store.refs() == []
@@ -0,0 +1,115 @@
+import json
+import time
+
+import pytest
+
+from state_store import (
+    BACKUP_FORMAT, DEFAULT_REQUEST_TTL, InMemoryStateBackend, RedisStateBackend, SQLiteStateBackend,
+    StateBackend, create_state_backend,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        store = InMemoryStateBackend(backup_file=str(tmp_path / "backup.json"))
+    elif request.param == "sqlite":
+        store = SQLiteStateBackend(str(tmp_path / "state.db"))
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        store = RedisStateBackend(client=fakeredis.FakeRedis())
+    yield store
+    store.close()
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_put_get_delete(backend):
+    backend.put("a", {"text": "hello"})
+    assert backend.get("a") == {"text": "hello"}
+    assert "a" in backend
+    assert backend.keys() == ["a"]
+    assert len(backend) == 1
+    assert backend.delete("a") is True
+    assert backend.get("a") is None
+    assert backend.delete("a") is False
+
+
+def test_put_overwrites(backend):
+    backend.put("a", {"v": 1})
+    backend.put("a", {"v": 2})
+    assert backend.get("a") == {"v": 2}
+    assert len(backend) == 1
+
+
+def test_entries_expire(backend):
+    backend.put("short", {"v": 1}, ttl=0.5)
+    backend.put("long", {"v": 2}, ttl=60)
+    time.sleep(0.6)
+    assert backend.get("short") is None
+    assert backend.get("long") == {"v": 2}
+    assert backend.keys() == ["long"]
+
+
+def test_sqlite_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer, reader = SQLiteStateBackend(path), SQLiteStateBackend(path)
+    writer.put("a", {"v": 1})
+    assert reader.get("a") == {"v": 1}
+    writer.close()
+    reader.close()
+
+
+def test_memory_backup_keeps_expiry_across_restarts(tmp_path):
+    backup = str(tmp_path / "backup.json")
+    store = InMemoryStateBackend(backup_file=backup)
+    store.put("short", {"v": 1}, ttl=1)
+    store.put("forever", {"v": 2})
+
+    restored = InMemoryStateBackend(backup_file=backup)
+    assert restored.get("short") == {"v": 1}
+    time.sleep(1.1)
+    assert restored.get("short") is None
+    assert restored.get("forever") == {"v": 2}
+
+
+def test_memory_legacy_backup_gets_default_ttl(tmp_path):
+    backup = tmp_path / "backup.json"
+    backup.write_text(json.dumps({"old": {"v": 1}}))
+
+    store = InMemoryStateBackend(backup_file=str(backup), default_ttl=60)
+    assert store.get("old") == {"v": 1}
+    assert 0 < store._expires["old"] - time.time() <= 60
+
+    store.put("new", {"v": 2})
+    saved = json.loads(backup.read_text())
+    assert saved["_format"] == BACKUP_FORMAT
+    assert set(saved["expires"]) == {"old", "new"}
+
+
+def test_create_state_backend_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("REQUEST_STORE_BACKEND", "sqlite")
+    monkeypatch.setenv("REQUEST_STORE_DB", str(tmp_path / "env.db"))
+    monkeypatch.setenv("REQUEST_STORE_TTL", "30")
+    store = create_state_backend()
+    assert isinstance(store, SQLiteStateBackend)
+    assert store.default_ttl == 30.0
+    store.close()
+
+    with pytest.raises(ValueError):
+        create_state_backend("memcached")
+
+
+def test_request_entries_expire_by_default(monkeypatch, tmp_path):
+    monkeypatch.delenv("REQUEST_STORE_TTL", raising=False)
+    store = create_state_backend("sqlite", path=str(tmp_path / "default.db"))
+    assert store.default_ttl == DEFAULT_REQUEST_TTL
+    store.close()
+
+    monkeypatch.setenv("REQUEST_STORE_TTL", "0")
+    store = create_state_backend("sqlite", path=str(tmp_path / "forever.db"))
+    assert store.default_ttl is None
+    store.close()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import time
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Speech-optimised target: mono Opus in an Ogg container at a low sample rate.
+# Enabled with AUDIO_PREPROCESS=1; needs ffmpeg on the PATH.
+PREPROCESS_ENABLED = os.environ.get('AUDIO_PREPROCESS', '0') == '1'
+TARGET_SAMPLE_RATE = int(os.environ.get('AUDIO_TARGET_SAMPLE_RATE', '16000'))
+TARGET_BITRATE = os.environ.get('AUDIO_TARGET_BITRATE', '24k')
+SILENCE_THRESHOLD_DB = os.environ.get('AUDIO_SILENCE_THRESHOLD_DB', '-45')
+FFMPEG_TIMEOUT = float(os.environ.get('AUDIO_PREPROCESS_TIMEOUT', '120'))
+COMPACT_MIME_TYPE = "audio/ogg"
+
+FFMPEG = shutil.which("ffmpeg")
+
+
+def _filter_chain() -> str:
+    """Downmix and resample, then trim leading and trailing silence."""
+    trim = (
+        f"silenceremove=start_periods=1:start_duration=0.2:"
+        f"start_threshold={SILENCE_THRESHOLD_DB}dB"
+    )
+    # Trailing silence is trimmed by reversing, trimming the start and reversing back
+    return (
+        f"aresample={TARGET_SAMPLE_RATE},aformat=channel_layouts=mono,"
+        f"{trim},areverse,{trim},areverse"
+    )
+
+
+def compress_for_speech(audio: bytes) -> Optional[dict]:
+    """
+    Re-encode audio into a compact speech encoding by piping it through ffmpeg.
+
+    This is not streaming: the whole upload is passed on stdin, and trimming
+    trailing silence (areverse) makes ffmpeg buffer the entire decoded
+    recording, about 64 KB per second of 16 kHz mono audio (roughly 230 MB
+    for an hour). Memory use therefore grows with the recording length.
+
+    Returns a dict with the compact bytes, their mime type and size/timing
+    figures, or None if preprocessing is unavailable or failed (callers then
+    fall back to the original upload).
+    """
+    if not FFMPEG:
+        logger.warning("ffmpeg not found; sending original audio without preprocessing.")
+        return None
+
+    command = [
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-vn", "-af", _filter_chain(),
+        "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE),
+        "-c:a", "libopus", "-b:a", TARGET_BITRATE, "-application", "voip",
+        "-f", "ogg", "pipe:1",
+    ]
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(command, input=audio, capture_output=True, timeout=FFMPEG_TIMEOUT, check=False)
+    except subprocess.TimeoutExpired:
+        logger.warning("Audio preprocessing timed out; sending original audio.")
+        return None
+    elapsed = time.perf_counter() - started
+
+    if result.returncode != 0 or not result.stdout:
+        logger.warning(f"Audio preprocessing failed; sending original audio. ffmpeg: {result.stderr.decode(errors='replace')[-500:]}")
+        return None
+
+    compact = result.stdout
+    if len(compact) >= len(audio):
+        logger.info("Preprocessed audio is not smaller than the original; keeping the original.")
+        return None
+
+    stats = {
+        "original_bytes": len(audio),
+        "compact_bytes": len(compact),
+        "reduction_percent": round(100 * (1 - len(compact) / len(audio)), 1),
+        "preprocess_seconds": round(elapsed, 3),
+    }
+    logger.info(
+        f"Compressed audio {stats['original_bytes']} -> {stats['compact_bytes']} bytes "
+        f"({stats['reduction_percent']}% smaller) in {stats['preprocess_seconds']}s."
+    )
+    return {"data": compact, "mime_type": COMPACT_MIME_TYPE, "stats": stats}
+
+
+if __name__ == "__main__":
+    # Benchmark: python audio_preprocess.py sample.wav sample.flac [--transcribe]
+    import argparse
+    import mimetypes
+
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Report size reduction and timing of audio preprocessing.")
+    parser.add_argument("files", nargs="+", help="audio files to benchmark")
+    parser.add_argument("--transcribe", action="store_true",
+                        help="also time a Gemini transcription of the original and compact audio")
+    args = parser.parse_args()
+
+    model = None
+    if args.transcribe:
+        import transcription_service
+        model = transcription_service.get_genai().GenerativeModel('models/gemini-2.0-flash')
+        prompt = "Transcribe the following audio file accurately and clearly to english"
+
+    def timed_transcription(data, mime_type):
+        started = time.perf_counter()
+        model.generate_content([prompt, {"mime_type": mime_type, "data": data}])
+        return time.perf_counter() - started
+
+    print(f"{'file':<32} {'type':<12} {'original':>10} {'compact':>10} {'saved':>7} {'encode s':>9} {'orig e2e s':>11} {'compact e2e s':>14}")
+    for path in args.files:
+        with open(path, 'rb') as f:
+            original = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        result = compress_for_speech(original)
+        if result is None:
+            print(f"{os.path.basename(path):<32} {content_type:<12} {len(original):>10} {'-':>10} {'-':>7} {'-':>9}")
+            continue
+        stats = result["stats"]
+        e2e = ("", "")
+        if model is not None:
+            original_seconds = timed_transcription(original, content_type)
+            compact_seconds = stats["preprocess_seconds"] + timed_transcription(result["data"], result["mime_type"])
+            e2e = (f"{original_seconds:.2f}", f"{compact_seconds:.2f}")
+        print(
+            f"{os.path.basename(path):<32} {content_type:<12} {stats['original_bytes']:>10} "
+            f"{stats['compact_bytes']:>10} {stats['reduction_percent']:>6}% {stats['preprocess_seconds']:>9} "
+            f"{e2e[0]:>11} {e2e[1]:>14}"
+        )
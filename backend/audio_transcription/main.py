@@ -1,10 +1,17 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
 from dotenv import load_dotenv
 import transcription_service
+from common.upstream import upstream_metrics
+from common.quota import create_scheduler, QuotaExceeded
+from common.profiling import install_profiling, stage
 import logging
 from typing import Dict
 from auth import get_current_user # Import the new dependency
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
+import math
 
 load_dotenv()
 
@@ -14,12 +21,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Validate configuration, then warm the Gemini and S3 clients in the background."""
+    transcription_service.load_settings()
+    warmup = asyncio.create_task(asyncio.to_thread(transcription_service.warm_up_clients))
+    yield
+    warmup.cancel()
+
 app = FastAPI(
     title="Audio Transcription API",
     description="An API to transcribe audio files using Google Gemini and store results on AWS S3.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Fair per-user admission to the Gemini quota (GEMINI_QUOTA_PER_MINUTE)
+gemini_quota = create_scheduler("gemini", per_minute=60)
+
 
 #new changes
 origins = [
@@ -37,6 +56,9 @@ app.add_middleware(
     allow_headers=["*"], # Allows all headers
 )
 
+# Opt-in sampling profiler and slow-request log (PROFILING_ENABLED=1)
+install_profiling(app)
+
 @app.post("/transcribe/", tags=["Transcription"])
 async def create_transcription(
     file: UploadFile = File(...),
@@ -61,6 +83,18 @@ async def create_transcription(
             detail=f"Unsupported file type: '{file.content_type}'. Please upload one of: {', '.join(supported_types)}"
         )
 
+    # Wait for this user's share of the Gemini quota before doing any work
+    try:
+        with stage("quota_wait"):
+            await gemini_quota.acquire(user_id)
+    except QuotaExceeded as e:
+        logger.warning(f"Quota exceeded for user '{user_id}': {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+
     try:
         transcribed_text = await transcription_service.process_audio_transcription(
             file=file.file,
@@ -81,7 +115,35 @@ async def create_transcription(
         logger.error(f"Unexpected error for user '{user_id}' with file '{file.filename}'.", exc_info=True)
         raise HTTPException(status_code=500, detail="An unexpected internal server error occurred.")
 
+@app.get("/usage", tags=["Transcription"])
+async def usage(current_user: dict = Depends(get_current_user)):
+    """
+    Returns the caller's transcription quota usage counters.
+    Requires authentication.
+    """
+    return gemini_quota.usage(current_user.get("user_id"))
+
 @app.get("/", tags=["Health Check"])
 async def root():
     logger.info("Health check endpoint was hit.")
-    return {"message": "Audio Transcription API is running."}
\ No newline at end of file
+    return {"message": "Audio Transcription API is running."}
+
+@app.get("/healthz", tags=["Health Check"])
+async def healthz():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["Health Check"])
+async def readyz():
+    """Readiness probe: the Gemini and S3 clients are initialised."""
+    checks = transcription_service.clients_ready()
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "starting", "checks": checks}
+    )
+
+@app.get("/upstreams", tags=["Health Check"])
+async def upstreams():
+    """Call counters and circuit-breaker state for the Gemini and S3 upstreams."""
+    return upstream_metrics()
\ No newline at end of file
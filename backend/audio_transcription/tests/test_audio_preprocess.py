@@ -0,0 +1,94 @@
+import io
+import math
+import shutil
+import struct
+import subprocess
+import wave
+
+import pytest
+
+import audio_preprocess
+from audio_preprocess import compress_for_speech
+
+
+def stereo_wav(seconds=2.0, rate=44100):
+    """A stereo 16-bit WAV of a 440 Hz tone, with half a second of silence at each end"""
+    frames = bytearray()
+    silence = int(rate * 0.5)
+    for i in range(int(rate * seconds)):
+        sample = 0 if i < silence or i >= rate * seconds - silence else int(12000 * math.sin(2 * math.pi * 440 * i / rate))
+        frames += struct.pack("<hh", sample, sample)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def fake_run(returncode=0, stdout=b"", stderr=b""):
+    def run(command, **kwargs):
+        return subprocess.CompletedProcess(command, returncode, stdout=stdout, stderr=stderr)
+    return run
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    monkeypatch.setattr(audio_preprocess, "FFMPEG", "/usr/bin/ffmpeg")
+
+
+def test_missing_ffmpeg_keeps_the_original(monkeypatch):
+    monkeypatch.setattr(audio_preprocess, "FFMPEG", None)
+    assert compress_for_speech(b"audio") is None
+
+
+def test_failed_encode_keeps_the_original(ffmpeg, monkeypatch):
+    monkeypatch.setattr(subprocess, "run", fake_run(returncode=1, stdout=b"partial", stderr=b"bad input"))
+    assert compress_for_speech(b"audio" * 100) is None
+
+
+def test_empty_output_keeps_the_original(ffmpeg, monkeypatch):
+    monkeypatch.setattr(subprocess, "run", fake_run(stdout=b""))
+    assert compress_for_speech(b"audio" * 100) is None
+
+
+def test_timeout_keeps_the_original(ffmpeg, monkeypatch):
+    def run(command, **kwargs):
+        raise subprocess.TimeoutExpired(command, kwargs.get("timeout"))
+
+    monkeypatch.setattr(subprocess, "run", run)
+    assert compress_for_speech(b"audio" * 100) is None
+
+
+def test_larger_output_keeps_the_original(ffmpeg, monkeypatch):
+    monkeypatch.setattr(subprocess, "run", fake_run(stdout=b"x" * 600))
+    assert compress_for_speech(b"audio" * 100) is None
+
+
+def test_smaller_output_is_returned_with_stats(ffmpeg, monkeypatch):
+    monkeypatch.setattr(subprocess, "run", fake_run(stdout=b"x" * 100))
+    result = compress_for_speech(b"audio" * 100)
+    assert result["data"] == b"x" * 100
+    assert result["mime_type"] == "audio/ogg"
+    assert result["stats"]["original_bytes"] == 500
+    assert result["stats"]["compact_bytes"] == 100
+    assert result["stats"]["reduction_percent"] == 80.0
+
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg is not installed")
+def test_stereo_wav_becomes_smaller_mono_opus(monkeypatch):
+    monkeypatch.setattr(audio_preprocess, "FFMPEG", shutil.which("ffmpeg"))
+    original = stereo_wav()
+    result = compress_for_speech(original)
+    assert result is not None
+    assert result["mime_type"] == "audio/ogg"
+    assert len(result["data"]) < len(original)
+
+    data = result["data"]
+    assert data.startswith(b"OggS")
+    head = data.index(b"OpusHead")
+    channels = data[head + 9]
+    input_rate = struct.unpack("<I", data[head + 12:head + 16])[0]
+    assert channels == 1
+    assert input_rate == audio_preprocess.TARGET_SAMPLE_RATE
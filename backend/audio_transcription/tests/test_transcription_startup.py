@@ -0,0 +1,13 @@
+SETTINGS = {
+    "GEMINI_API_KEY": "test", "S3_BUCKET_NAME": "test", "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test", "JWT_SECRET_KEY": "test", "ALGORITHM": "HS256",
+}
+
+
+def test_import_is_fast_and_defers_cloud_sdks(profile_import, import_time_budget_ms, tmp_path):
+    elapsed_ms, imported = profile_import(
+        "audio_transcription", requires=("fastapi", "dotenv", "jwt"), env=SETTINGS, cwd=str(tmp_path)
+    )
+    assert "boto3" not in imported
+    assert "google.generativeai" not in imported
+    assert elapsed_ms < import_time_budget_ms, f"import main took {elapsed_ms:.0f}ms"
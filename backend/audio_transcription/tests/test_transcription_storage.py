@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+import transcription_service
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="audio")
+        monkeypatch.setattr(transcription_service, "S3_BUCKET_NAME", "audio")
+        monkeypatch.setattr(transcription_service, "_s3_client", client)
+        yield client
+
+
+def store(user_id, request_id, audio=b"RIFF audio"):
+    return transcription_service.store_audio(
+        audio, f"private/{user_id}/audio/{request_id}.json", request_id, user_id,
+        "memo.wav", "audio/wav", f"private/{user_id}/transcripts/{request_id}.txt"
+    )
+
+
+def keys(client, prefix):
+    return sorted(item["Key"] for item in client.list_objects_v2(Bucket="audio", Prefix=prefix).get("Contents", []))
+
+
+def test_audio_stays_in_the_uploaders_private_folder(bucket):
+    digest = store("alice", "r1")
+    assert store("alice", "r2") == digest
+    assert store("bob", "r3") == digest
+
+    blob_key = f"sha256/{digest[:2]}/{digest}"
+    # Deduplicated per user: one copy each for alice and bob, never shared across users
+    assert [key for key in keys(bucket, "") if key.endswith(blob_key)] == [
+        f"private/alice/blobs/{blob_key}", f"private/bob/blobs/{blob_key}"
+    ]
+    assert all(key.startswith(("private/alice/", "private/bob/")) for key in keys(bucket, ""))
+
+    manifest = json.loads(bucket.get_object(Bucket="audio", Key="private/alice/audio/r2.json")["Body"].read())
+    assert manifest["audio_key"] == f"private/alice/blobs/{blob_key}"
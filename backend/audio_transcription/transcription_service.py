@@ -1,9 +1,15 @@
 import os
-import boto3
-import google.generativeai as genai
-from botocore.exceptions import NoCredentialsError, ClientError
+import json
+import uuid
 import logging
+import threading
+from datetime import datetime
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from common.upstream import get_upstream, CircuitOpenError, UpstreamOverloaded, UpstreamTimeout
+from common.profiling import stage
+import audio_preprocess
+from common.blob_store import S3BlobStore
 
 # Configure logging
 logging.basicConfig(
@@ -12,63 +18,208 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load required environment variables for Gemini and AWS
-try:
-    GEMINI_API_KEY = os.environ['GEMINI_API_KEY']
-    S3_BUCKET_NAME = os.environ['S3_BUCKET_NAME']
-    AWS_ACCESS_KEY_ID = os.environ['AWS_ACCESS_KEY_ID']
-    AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
-    AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
-except KeyError as e:
-    logger.error(f"FATAL: Environment variable {e} is not set. The application cannot start.")
-    raise SystemExit(f"Error: Missing required environment variable: {e}")
-
-# Configure the clients
-genai.configure(api_key=GEMINI_API_KEY)
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+# Settings and SDK clients are loaded lazily: boto3 and google.generativeai are
+# slow to import, so they are created on first use or by warm_up_clients().
+GEMINI_API_KEY = None
+S3_BUCKET_NAME = None
+AWS_ACCESS_KEY_ID = None
+AWS_SECRET_ACCESS_KEY = None
+AWS_REGION = None
+
+_s3_client = None
+_genai = None
+_client_lock = threading.Lock()
+
+# Key prefix for content-addressed audio blobs inside each user's private
+# folder, so per-user bucket policies and lifecycle rules keep covering the
+# audio. Identical uploads are deduplicated per user, never across users.
+BLOB_PREFIX = os.environ.get('S3_BLOB_PREFIX', 'blobs/')
+
+# Deadline, retry and circuit-breaker policies for the upstream calls
+gemini_upstream = get_upstream("gemini", timeout=120.0, max_attempts=2)
+s3_upstream = get_upstream("s3", timeout=30.0, max_attempts=3)
+
+
+def load_settings():
+    """Load required environment variables for Gemini and AWS."""
+    global GEMINI_API_KEY, S3_BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION
+    try:
+        GEMINI_API_KEY = os.environ['GEMINI_API_KEY']
+        S3_BUCKET_NAME = os.environ['S3_BUCKET_NAME']
+        AWS_ACCESS_KEY_ID = os.environ['AWS_ACCESS_KEY_ID']
+        AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
+        AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+    except KeyError as e:
+        logger.error(f"FATAL: Environment variable {e} is not set. The application cannot start.")
+        raise SystemExit(f"Error: Missing required environment variable: {e}")
+
+
+def get_s3_client():
+    """Return the shared S3 client, creating it on first use."""
+    global _s3_client
+    if _s3_client is None:
+        with _client_lock:
+            if _s3_client is None:
+                if S3_BUCKET_NAME is None:
+                    load_settings()
+                import boto3
+                from botocore.config import Config
+                _s3_client = boto3.client(
+                    's3',
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    region_name=AWS_REGION,
+                    # Retries are handled by s3_upstream, so botocore makes a single attempt
+                    config=Config(
+                        connect_timeout=5,
+                        read_timeout=s3_upstream.timeout,
+                        retries={'max_attempts': 1, 'mode': 'standard'}
+                    )
+                )
+    return _s3_client
+
+
+def get_blob_store(user_id: str) -> S3BlobStore:
+    """Return the content-addressed S3 store for a user's uploaded audio."""
+    return S3BlobStore(
+        get_s3_client(), S3_BUCKET_NAME,
+        prefix=f"private/{user_id}/{BLOB_PREFIX}", call=s3_upstream.call
+    )
+
+
+def get_genai():
+    """Return the configured google.generativeai module, importing it on first use."""
+    global _genai
+    if _genai is None:
+        with _client_lock:
+            if _genai is None:
+                if GEMINI_API_KEY is None:
+                    load_settings()
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                _genai = genai
+    return _genai
+
+
+def upstream_http_error(e: Exception, service: str, detail: str) -> HTTPException:
+    """Map an upstream failure to the HTTP error returned to the client."""
+    if isinstance(e, (CircuitOpenError, UpstreamOverloaded)):
+        return HTTPException(status_code=503, detail=f"{service} is temporarily unavailable. Please retry shortly.")
+    if isinstance(e, UpstreamTimeout):
+        return HTTPException(status_code=504, detail=f"{service} did not respond in time.")
+    return HTTPException(status_code=500, detail=detail)
+
+
+def clients_ready() -> dict:
+    """Report which upstream clients have been initialised."""
+    return {
+        "s3_client": _s3_client is not None,
+        "gemini_client": _genai is not None,
+    }
+
+
+def warm_up_clients():
+    """Import the cloud SDKs and create the clients ahead of the first request."""
+    for name, factory in (("S3", get_s3_client), ("Gemini", get_genai)):
+        try:
+            factory()
+            logger.info(f"{name} client is ready.")
+        except Exception:
+            logger.error(f"{name} client warm-up failed.", exc_info=True)
+
+
+def store_audio(file_content: bytes, manifest_key: str, request_id: str, user_id: str,
+                filename: str, content_type: str, transcript_key: str) -> str:
+    """Archive the audio (deduplicated) and its manifest in S3. Returns the audio blob digest."""
+    # Runs in the threadpool: the first call may still be creating the S3 client
+    blob_store = get_blob_store(user_id)
+    audio_blob = blob_store.put(
+        file_content, manifest_key,
+        metadata={"user_id": user_id, "filename": filename},
+        content_type=content_type
+    )
+    manifest = {
+        "request_id": request_id,
+        "user_id": user_id,
+        "filename": filename,
+        "content_type": content_type,
+        "size": len(file_content),
+        "audio_blob": audio_blob,
+        "audio_key": blob_store.key(audio_blob),
+        "transcript_key": transcript_key,
+        "uploaded_at": datetime.utcnow().isoformat()
+    }
+    put_object(manifest_key, json.dumps(manifest).encode('utf-8'), ContentType="application/json")
+    return audio_blob
+
+
+def put_object(key: str, body: bytes, **kwargs):
+    """Write an object to the bucket under the S3 upstream policy."""
+    return s3_upstream.call(get_s3_client().put_object, Bucket=S3_BUCKET_NAME, Key=key, Body=body, **kwargs)
+
+
+def transcribe(audio_part: dict, prompt: str):
+    """Send the audio to Gemini under the Gemini upstream policy."""
+    model = get_genai().GenerativeModel('models/gemini-2.0-flash')
+    return gemini_upstream.call(
+        model.generate_content, [prompt, audio_part],
+        request_options={"timeout": gemini_upstream.timeout}
+    )
+
 
 # The rest of the file (the process_audio_transcription function) remains exactly the same.
 async def process_audio_transcription(file, filename: str, content_type: str, user_id: str) -> str:
     # ... (function implementation is unchanged)
     logger.info(f"Starting transcription process for file: {filename} for user: {user_id}")
 
-    # Define user-specific paths
-    s3_audio_key = f"private/{user_id}/audio/{filename}"
-    s3_transcript_key = f"private/{user_id}/transcripts/{os.path.splitext(filename)[0]}.txt"
+    # Define user-specific paths; the audio itself is stored once per user by content hash
+    # and the per-request manifest only references it
+    request_id = str(uuid.uuid4())
+    s3_audio_key = f"private/{user_id}/audio/{request_id}.json"
+    s3_transcript_key = f"private/{user_id}/transcripts/{request_id}.txt"
 
     try:
-        file_content = file.read()
+        with stage("read_upload"):
+            file_content = file.read()
     finally:
         file.close()
     
     logger.info(f"Read {len(file_content)} bytes from uploaded file.")
 
-    # Upload original audio to user's private S3 folder
+    # Archive the original audio (deduplicated) and its manifest in the user's private S3 folder
     try:
-        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=s3_audio_key, Body=file_content)
-        logger.info(f"Uploaded audio '{s3_audio_key}' to S3 for user '{user_id}'.")
+        with stage("s3_upload_audio"):
+            audio_blob = await run_in_threadpool(
+                store_audio, file_content, s3_audio_key, request_id, user_id,
+                filename, content_type, s3_transcript_key
+            )
+        logger.info(f"Archived audio blob '{audio_blob}' with manifest '{s3_audio_key}' for user '{user_id}'.")
     except Exception as e:
         logger.error(f"S3 upload failed for user '{user_id}'.", exc_info=True)
-        raise HTTPException(status_code=500, detail="Failed to upload audio to S3.")
+        raise upstream_http_error(e, "Storage", "Failed to upload audio to S3.")
+
+    # Optionally send a compact mono speech encoding instead of the original
+    audio_part = {
+        "mime_type": content_type,
+        "data": file_content
+    }
+    if audio_preprocess.PREPROCESS_ENABLED:
+        with stage("preprocess_audio"):
+            compact = await run_in_threadpool(audio_preprocess.compress_for_speech, file_content)
+        if compact is not None:
+            audio_part = {
+                "mime_type": compact["mime_type"],
+                "data": compact["data"]
+            }
 
     # Transcribe using Gemini API
     try:
-        logger.info("Sending audio data directly to Google for transcription...")
-
-        audio_part = {
-            "mime_type": content_type,
-            "data": file_content
-        }
+        logger.info(f"Sending {len(audio_part['data'])} bytes of {audio_part['mime_type']} audio to Google for transcription...")
 
-        model = genai.GenerativeModel('models/gemini-2.0-flash')
         prompt = "Transcribe the following audio file accurately and clearly to english"
         
-        response = model.generate_content([prompt, audio_part])
+        with stage("gemini_transcribe"):
+            response = await run_in_threadpool(transcribe, audio_part, prompt)
         
         transcribed_text = response.text.strip()
         
@@ -78,17 +229,16 @@ async def process_audio_transcription(file, filename: str, content_type: str, us
         
         logger.info(f"Successfully transcribed audio for user '{user_id}'.")
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"GEMINI API FAILED for user '{user_id}'.", exc_info=True)
-        raise HTTPException(status_code=500, detail="Error during transcription with the AI service.")
+        raise upstream_http_error(e, "Transcription service", "Error during transcription with the AI service.")
 
     # Save transcription text to user's private S3 folder
     try:
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_transcript_key,
-            Body=transcribed_text.encode('utf-8')
-        )
+        with stage("s3_upload_transcript"):
+            await run_in_threadpool(put_object, s3_transcript_key, transcribed_text.encode('utf-8'))
         logger.info(f"Saved transcription to '{s3_transcript_key}' in S3 for user '{user_id}'.")
     except Exception as e:
         logger.warning(f"Could not save transcript to S3 for user '{user_id}'. Error: {e}")
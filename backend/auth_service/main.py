@@ -1,20 +1,37 @@
 from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 import crud
 import models
 import schemas
 import security
 from database import SessionLocal, engine, init_db
+from common.profiling import install_profiling, stage
 
-# Initialize the database and create tables
-init_db()
+# Set once the tables have been created at startup
+db_initialized = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the database and create tables on startup."""
+    global db_initialized
+    init_db()
+    db_initialized = True
+    yield
+    engine.dispose()
 
 app = FastAPI(
     title="Authentication Service",
     description="A microservice to handle user authentication and JWT generation.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Opt-in sampling profiler and slow-request log (PROFILING_ENABLED=1)
+install_profiling(app)
+
 # Dependency to get a DB session
 def get_db():
     db = SessionLocal()
@@ -39,18 +56,22 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     if db_user:
         raise HTTPException(status_code=400, detail="Username already taken.")
 
-    return crud.create_user(db=db, user=user)
+    with stage("create_user"):
+        return crud.create_user(db=db, user=user)
 
 @app.post("/login", response_model=schemas.Token, tags=["Auth"])
 def login_for_access_token(form_data: schemas.UserLogin, db: Session = Depends(get_db)):
     """
     Handles user login and returns a JWT.
     """
-    user = crud.get_user_by_username(db, username=form_data.username_or_email)
-    if not user:
-        user = crud.get_user_by_email(db, email=form_data.username_or_email)
+    with stage("user_lookup"):
+        user = crud.get_user_by_username(db, username=form_data.username_or_email)
+        if not user:
+            user = crud.get_user_by_email(db, email=form_data.username_or_email)
     
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    with stage("verify_password"):
+        password_ok = user is not None and security.verify_password(form_data.password, user.hashed_password)
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username, email, or password",
@@ -64,4 +85,26 @@ def login_for_access_token(form_data: schemas.UserLogin, db: Session = Depends(g
 
 @app.get("/", tags=["Health Check"])
 def root():
-    return {"message": "Authentication Service is running."}
\ No newline at end of file
+    return {"message": "Authentication Service is running."}
+
+@app.get("/healthz", tags=["Health Check"])
+def healthz():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["Health Check"])
+def readyz():
+    """Readiness probe: the tables exist and the database answers queries."""
+    checks = {"database_initialized": db_initialized, "database_reachable": False}
+    if db_initialized:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            checks["database_reachable"] = True
+        except Exception:
+            pass
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "starting", "checks": checks}
+    )
\ No newline at end of file
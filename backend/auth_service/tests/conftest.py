@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Service modules are imported top-level, as uvicorn does when run from the service directory
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.dirname(SERVICE_DIR))
@@ -0,0 +1,16 @@
+import os
+
+
+def test_import_is_fast_and_does_not_touch_the_database(profile_import, import_time_budget_ms, tmp_path):
+    database = tmp_path / "data" / "users.db"
+    elapsed_ms, _ = profile_import(
+        "auth_service", requires=("fastapi", "sqlalchemy", "dotenv", "jwt", "passlib"),
+        env={
+            "DATABASE_URL": f"sqlite:///{database}", "JWT_SECRET_KEY": "test",
+            "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+        },
+        cwd=str(tmp_path)
+    )
+    # Tables are created by the lifespan hook, not at import time
+    assert not os.path.exists(database)
+    assert elapsed_ms < import_time_budget_ms, f"import main took {elapsed_ms:.0f}ms"
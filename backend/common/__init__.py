@@ -0,0 +1,9 @@
+"""
+Modules shared by the backend services: resilient upstream calls (upstream),
+per-user quota scheduling (quota), opt-in profiling (profiling) and
+content-addressed blob storage (blob_store).
+
+Services import them as `common.<module>`, so the backend directory must be
+on the import path: the Docker images copy this package next to each
+service, and local runs set PYTHONPATH=.. from the service directory.
+"""
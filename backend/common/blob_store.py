@@ -0,0 +1,304 @@
+"""
+Content-addressed blob storage for uploaded images and audio.
+Payloads are stored once under their SHA-256 digest. Every request or
+document that uses a payload holds a named reference to it, and the payload
+is deleted when its last reference is released. Identical uploads therefore
+cost one copy on disk or in S3, and per-request metadata only needs the
+digest.
+
+Backends:
+    LocalBlobStore - files under <root>/sha256/ab/<digest>, references in SQLite
+    S3BlobStore    - objects under <prefix>sha256/ab/<digest>, one marker object
+                     per reference under <prefix>refs/<digest>/
+
+S3 has no transaction spanning the reference markers and the blob, so
+S3BlobStore.release is only safe when no put of the same content can run at
+the same time (see its docstring). The services never release S3 blobs; the
+audio archive keeps every upload.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import quote
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _blob_key(digest):
+    return f"sha256/{digest[:2]}/{digest}"
+
+
+class BlobStore(ABC):
+    """Interface for content-addressed, reference-counted blob storage."""
+
+    @abstractmethod
+    def put(self, data, ref, metadata=None):
+        """Store data (if new) and add ref to it. Returns the SHA-256 digest."""
+
+    @abstractmethod
+    def add_ref(self, digest, ref, metadata=None):
+        """Add a reference to an existing blob (idempotent per ref)."""
+
+    @abstractmethod
+    def release(self, digest, ref):
+        """Drop a reference. Returns True if the blob itself was deleted."""
+
+    @abstractmethod
+    def refcount(self, digest):
+        """Number of references held on a blob."""
+
+    @abstractmethod
+    def exists(self, digest):
+        """Whether the blob's payload is stored."""
+
+    @abstractmethod
+    def get(self, digest):
+        """Return the blob's bytes."""
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs on the local filesystem with references tracked in SQLite.
+
+    Blob files are written to a temporary file and renamed into place, so
+    readers never see a partial blob.
+    """
+
+    def __init__(self, root="blobs"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.db_path = os.path.join(root, "refs.db")
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blob_refs ("
+            " digest TEXT NOT NULL, ref TEXT NOT NULL, metadata TEXT, created_at REAL NOT NULL,"
+            " PRIMARY KEY (digest, ref))"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def path(self, digest):
+        """Filesystem path of a blob"""
+        return os.path.join(self.root, _blob_key(digest))
+
+    def add_ref(self, digest, ref, metadata=None):
+        self._connect().execute(
+            "INSERT OR IGNORE INTO blob_refs (digest, ref, metadata, created_at) VALUES (?, ?, ?, ?)",
+            (digest, ref, json.dumps(metadata) if metadata else None, time.time()),
+        )
+
+    def _install(self, source_path, digest):
+        """Move a fully written temp file into place unless the blob already exists"""
+        target = self.path(digest)
+        if os.path.exists(target):
+            os.remove(source_path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source_path, target)
+
+    def put(self, data, ref, metadata=None):
+        digest = sha256_bytes(data)
+        # The reference is recorded first so a concurrent release cannot
+        # delete the blob between the existence check and the write
+        self.add_ref(digest, ref, metadata)
+        if not os.path.exists(self.path(digest)):
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self._install(tmp_path, digest)
+        return digest
+
+    def put_file(self, path, ref, metadata=None):
+        """
+        Store a file that was already written to disk (e.g. a streamed upload).
+
+        The file is moved into the store when its content is new and removed
+        otherwise; it must be on the same filesystem as the store root.
+        """
+        digest = sha256_file(path)
+        self.add_ref(digest, ref, metadata)
+        self._install(path, digest)
+        return digest
+
+    def release(self, digest, ref):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM blob_refs WHERE digest = ? AND ref = ?", (digest, ref))
+            remaining = conn.execute("SELECT COUNT(*) FROM blob_refs WHERE digest = ?", (digest,)).fetchone()[0]
+            deleted = False
+            if not remaining and os.path.exists(self.path(digest)):
+                os.remove(self.path(digest))
+                deleted = True
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def refcount(self, digest):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM blob_refs WHERE digest = ?", (digest,)
+        ).fetchone()[0]
+
+    def refs(self, prefix="", older_than=None):
+        """(digest, ref) pairs whose ref starts with prefix, optionally only those created before older_than"""
+        query = "SELECT digest, ref FROM blob_refs WHERE substr(ref, 1, ?) = ?"
+        params = [len(prefix), prefix]
+        if older_than is not None:
+            query += " AND created_at < ?"
+            params.append(older_than)
+        return [tuple(row) for row in self._connect().execute(query + " ORDER BY created_at", params)]
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def get(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class S3BlobStore(BlobStore):
+    """
+    Blobs in an S3 bucket.
+
+    Each reference is a small marker object, so adding and releasing
+    references never rewrites the blob. Works with any client exposing the
+    boto3 S3 API (put_object, head_object, get_object, delete_object,
+    list_objects_v2), e.g. a moto or MinIO stand-in for local testing.
+
+    Args:
+        client: boto3 S3 client
+        bucket (str): Bucket name
+        prefix (str): Key prefix for blobs and reference markers
+        call (callable): Optional wrapper for every client call, e.g. an
+            Upstream.call adding deadlines, retries and circuit breaking
+    """
+
+    def __init__(self, client, bucket, prefix="blobs/", call=None):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self._call = call or (lambda fn, *args, **kwargs: fn(*args, **kwargs))
+
+    def key(self, digest):
+        """Object key of a blob"""
+        return f"{self.prefix}{_blob_key(digest)}"
+
+    def _refs_prefix(self, digest):
+        return f"{self.prefix}refs/{digest}/"
+
+    def _ref_key(self, digest, ref):
+        return self._refs_prefix(digest) + quote(ref, safe='')
+
+    @staticmethod
+    def _is_not_found(exc):
+        response = getattr(exc, 'response', None) or {}
+        return str(response.get('Error', {}).get('Code')) in ('404', 'NoSuchKey', 'NotFound')
+
+    def add_ref(self, digest, ref, metadata=None):
+        self._call(
+            self.client.put_object,
+            Bucket=self.bucket, Key=self._ref_key(digest, ref),
+            Body=json.dumps(metadata or {}).encode('utf-8'),
+            ContentType="application/json",
+        )
+
+    def _head(self, digest):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(digest))
+            return True
+        except Exception as e:
+            if self._is_not_found(e):
+                return False
+            raise
+
+    def exists(self, digest):
+        # A missing blob is an answer, not an upstream failure, so the 404 is
+        # resolved inside the wrapped call and never reaches its error counts
+        return self._call(self._head, digest)
+
+    def put(self, data, ref, metadata=None, content_type=None):
+        digest = sha256_bytes(data)
+        self.add_ref(digest, ref, metadata)
+        if not self.exists(digest):
+            extra = {"ContentType": content_type} if content_type else {}
+            self._call(
+                self.client.put_object,
+                Bucket=self.bucket, Key=self.key(digest), Body=data,
+                ChecksumSHA256=_b64_digest(digest), **extra,
+            )
+        return digest
+
+    def refcount(self, digest):
+        count = 0
+        token = None
+        while True:
+            kwargs = {"Bucket": self.bucket, "Prefix": self._refs_prefix(digest)}
+            if token:
+                kwargs["ContinuationToken"] = token
+            page = self._call(self.client.list_objects_v2, **kwargs)
+            count += page.get("KeyCount", len(page.get("Contents", [])))
+            if not page.get("IsTruncated"):
+                return count
+            token = page.get("NextContinuationToken")
+
+    def release(self, digest, ref):
+        """
+        Drop a reference and delete the blob if no marker is left.
+
+        Not safe against a concurrent put of the same content: the put can
+        add its marker and see the blob just before this deletes it, leaving
+        a reference to a missing blob. Only call it when no put of this
+        digest can overlap, e.g. from an offline cleanup job.
+        """
+        self._call(self.client.delete_object, Bucket=self.bucket, Key=self._ref_key(digest, ref))
+        page = self._call(
+            self.client.list_objects_v2, Bucket=self.bucket, Prefix=self._refs_prefix(digest), MaxKeys=1
+        )
+        if page.get("KeyCount", len(page.get("Contents", []))):
+            return False
+        self._call(self.client.delete_object, Bucket=self.bucket, Key=self.key(digest))
+        return True
+
+    def get(self, digest):
+        response = self._call(self.client.get_object, Bucket=self.bucket, Key=self.key(digest))
+        return response["Body"].read()
+
+
+def _b64_digest(digest):
+    """S3 ChecksumSHA256 value (base64 of the raw digest) so S3 verifies the upload"""
+    return base64.b64encode(bytes.fromhex(digest)).decode('ascii')
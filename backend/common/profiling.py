@@ -0,0 +1,199 @@
+"""
+Opt-in profiling for the FastAPI services.
+When PROFILING_ENABLED=1, install_profiling(app) adds:
+
+    GET /admin/profile?seconds=N   sampling profile of every thread for N seconds,
+                                   returned as collapsed stacks (flamegraph.pl,
+                                   speedscope and inferno all read this format)
+    GET /admin/slow-requests       recent requests slower than
+                                   SLOW_REQUEST_THRESHOLD_MS, with a per-stage
+                                   timing breakdown
+
+Handlers mark their stages with `with stage("ocr"): ...`. When profiling is
+disabled, neither the middleware nor the routes are installed and stage() is
+a context-variable lookup that returns a shared no-op.
+
+The admin endpoints require PROFILING_ADMIN_TOKEN in the X-Admin-Token
+header. If profiling is enabled without a token, nothing is installed and a
+warning is logged: the profiler exposes stack frames and request paths, so it
+is never served unauthenticated.
+"""
+
+import asyncio
+import contextvars
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', '1000'))
+SLOW_REQUEST_BUFFER = int(os.environ.get('SLOW_REQUEST_BUFFER', '200'))
+MAX_PROFILE_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+# Stage timings of the request being handled (None outside a profiled request)
+_stages = contextvars.ContextVar('profiling_stages', default=None)
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class _Stage:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.append((self.name, (time.perf_counter() - self.start) * 1000))
+        return False
+
+
+def stage(name):
+    """Time a named stage of the current request (no-op unless profiling is on)"""
+    timings = _stages.get()
+    if timings is None:
+        return _NOOP_STAGE
+    return _Stage(timings, name)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that samples the stacks of all threads.
+
+    Samples are taken from sys._current_frames() on a background thread, so
+    the profiled code is not instrumented and runs at full speed between
+    samples.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+    def run(self, seconds):
+        """Sample for the given duration and return collapsed stacks"""
+        own_thread = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self._frame_label(frame))
+                    frame = frame.f_back
+                labels.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(self.interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware that records requests slower than a threshold into a ring buffer"""
+
+    def __init__(self, app, buffer, threshold_ms=SLOW_REQUEST_THRESHOLD_MS):
+        self.app = app
+        self.buffer = buffer
+        self.threshold_ms = threshold_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = _stages.set(timings)
+        response = {"status": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            _stages.reset(token)
+            if elapsed_ms >= self.threshold_ms:
+                staged_ms = sum(ms for _, ms in timings)
+                self.buffer.append({
+                    "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "status": response["status"],
+                    "duration_ms": round(elapsed_ms, 2),
+                    "stages": [{"stage": name, "ms": round(ms, 2)} for name, ms in timings],
+                    "unstaged_ms": round(max(0.0, elapsed_ms - staged_ms), 2),
+                })
+
+
+def install_profiling(app, enabled=PROFILING_ENABLED, admin_token=None):
+    """
+    Add the slow-request middleware and /admin profiling routes when enabled.
+    Returns True if they were installed.
+    """
+    if not enabled:
+        return False
+
+    admin_token = admin_token or os.environ.get('PROFILING_ADMIN_TOKEN')
+    if not admin_token:
+        logger.warning("PROFILING_ENABLED=1 but PROFILING_ADMIN_TOKEN is not set; profiling is not installed.")
+        return False
+
+    slow_requests = deque(maxlen=SLOW_REQUEST_BUFFER)
+    profile_lock = asyncio.Lock()
+    router = APIRouter(prefix="/admin", tags=["Profiling"])
+
+    def check_token(token):
+        if not token or not hmac.compare_digest(token.encode(), admin_token.encode()):
+            raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+    @router.get("/profile", response_class=PlainTextResponse)
+    async def profile(seconds: float = Query(10.0, gt=0, le=MAX_PROFILE_SECONDS),
+                      x_admin_token: str = Header(None)):
+        """Sample all threads for N seconds and return collapsed stacks"""
+        check_token(x_admin_token)
+        if profile_lock.locked():
+            raise HTTPException(status_code=409, detail="A profile is already running.")
+        async with profile_lock:
+            collapsed = await asyncio.to_thread(SamplingProfiler().run, seconds)
+        return PlainTextResponse(collapsed)
+
+    @router.get("/slow-requests")
+    async def slow_request_log(limit: int = Query(50, gt=0), path: str = None,
+                               x_admin_token: str = Header(None)):
+        """Most recent requests above the latency threshold, newest first"""
+        check_token(x_admin_token)
+        entries = [entry for entry in reversed(slow_requests) if path is None or entry["path"] == path]
+        return {"threshold_ms": SLOW_REQUEST_THRESHOLD_MS, "requests": entries[:limit]}
+
+    app.include_router(router)
+    app.add_middleware(SlowRequestMiddleware, buffer=slow_requests, threshold_ms=SLOW_REQUEST_THRESHOLD_MS)
+    return True
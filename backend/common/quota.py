@@ -0,0 +1,267 @@
+"""
+Per-user rate limiting for paid upstream quotas (Vision, Gemini).
+A global token bucket caps the aggregate request rate at the upstream quota,
+and a weighted fair queue in front of it decides which user's request gets
+the next token. Requests over the cap wait briefly instead of failing
+outright. Each user is queued separately, so a user uploading in a loop only
+delays their own requests.
+
+Limits are enforced per process: when running several workers, set the
+quota to the upstream limit divided by the number of workers.
+
+Per-user state is bounded: finish tags the virtual clock has passed are
+dropped, and usage counters of users idle for longer than usage_ttl (or
+beyond max_tracked_users) are expired.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict
+
+
+class QuotaExceeded(Exception):
+    """The request could not be admitted within the allowed wait."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate tokens per second.
+
+    A request costing more than the bucket capacity is admitted once the
+    bucket is full and leaves it in debt, so the long-run rate never exceeds
+    the configured rate.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until_available(self, cost=1):
+        """Seconds until try_take(cost) would succeed."""
+        self._refill()
+        missing = min(cost, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def try_take(self, cost=1):
+        self._refill()
+        if self.tokens >= min(cost, self.capacity):
+            self.tokens -= cost
+            return True
+        return False
+
+
+class FairScheduler:
+    """
+    Start-time fair queuing of users in front of a global token bucket.
+
+    Each waiting request is tagged with a virtual start time of
+    max(virtual clock, user's last finish tag), and its finish tag adds
+    cost / weight. The request with the smallest start tag is admitted
+    whenever a token is available. A user's share of the quota is
+    proportional to their weight, whatever their queue depth.
+
+    Args:
+        name (str): Upstream name used in error messages
+        rate (float): Global admissions per second (the upstream quota)
+        burst (float): Bucket capacity, i.e. how many requests may start at once
+        max_wait (float): Seconds a request may queue before QuotaExceeded
+        max_queue_per_user (int): Waiting requests allowed per user
+        weights (dict): Optional per-user weights (default 1.0)
+        usage_ttl (float): Seconds after a user's last request before their
+            usage counters are forgotten
+        max_tracked_users (int): Usage counters kept at most; the least
+            recently seen users are forgotten first
+    """
+
+    def __init__(self, name, rate, burst=None, max_wait=10.0, max_queue_per_user=20,
+                 weights=None, usage_ttl=3600.0, max_tracked_users=10000, clock=time.monotonic):
+        self.name = name
+        self.max_wait = max_wait
+        self.max_queue_per_user = max_queue_per_user
+        self.weights = weights or {}
+        self.usage_ttl = usage_ttl
+        self.max_tracked_users = max_tracked_users
+        self.bucket = TokenBucket(rate, burst if burst is not None else max(1.0, rate), clock=clock)
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_tags = {}
+        self._depth = {}
+        self._dispatcher = None
+        # Usage counters in least-recently-seen order, and when each user was last seen
+        self._usage = OrderedDict()
+        self._last_seen = {}
+
+    @staticmethod
+    def _new_usage():
+        return {
+            "requests": 0, "admitted": 0, "queued": 0, "rejected": 0,
+            "units": 0.0, "wait_seconds": 0.0,
+        }
+
+    def _user_usage(self, user_id):
+        """Usage counters of a user making a request (marks them as recently seen)"""
+        now = self.clock()
+        usage = self._usage.get(user_id)
+        if usage is None:
+            usage = self._usage[user_id] = self._new_usage()
+        else:
+            self._usage.move_to_end(user_id)
+        self._last_seen[user_id] = now
+        self._expire_usage(now)
+        return usage
+
+    def _expire_usage(self, now):
+        """Forget the least recently seen users while over the TTL or the size cap"""
+        while self._usage:
+            user_id = next(iter(self._usage))
+            idle = now - self._last_seen[user_id]
+            if len(self._usage) <= self.max_tracked_users and idle < self.usage_ttl:
+                break
+            if user_id in self._depth:
+                # Still waiting for a token; its counters are updated on admission
+                break
+            del self._usage[user_id]
+            del self._last_seen[user_id]
+
+    def _prune_finish_tags(self):
+        """Drop finish tags the virtual clock has passed; they no longer affect scheduling"""
+        self._finish_tags = {
+            user_id: tag for user_id, tag in self._finish_tags.items() if tag > self._virtual_time
+        }
+
+    def usage(self, user_id=None):
+        """Usage counters for one user, or the global totals (no per-user breakdown)."""
+        if user_id is not None:
+            usage = self._usage.get(user_id)
+            return dict(usage) if usage is not None else self._new_usage()
+        return {
+            "rate_per_second": self.bucket.rate,
+            "burst": self.bucket.capacity,
+            "queued_now": sum(self._depth.values()),
+            "tracked_users": len(self._usage),
+        }
+
+    def _admit(self, usage, cost, waited):
+        usage["admitted"] += 1
+        usage["units"] += cost
+        usage["wait_seconds"] += waited
+
+    async def acquire(self, user_id, cost=1, weight=None):
+        """
+        Wait for this user's turn and take cost tokens from the global bucket.
+
+        Raises:
+            QuotaExceeded: the user's queue is full or max_wait elapsed
+        """
+        usage = self._user_usage(user_id)
+        usage["requests"] += 1
+
+        if not self._heap and self.bucket.try_take(cost):
+            self._admit(usage, cost, 0.0)
+            return
+
+        if self._depth.get(user_id, 0) >= self.max_queue_per_user:
+            usage["rejected"] += 1
+            raise QuotaExceeded(
+                f"Too many {self.name} requests queued for this user.",
+                retry_after=self.bucket.time_until_available(cost) or 1.0
+            )
+
+        weight = weight or self.weights.get(user_id, 1.0)
+        start = max(self._virtual_time, self._finish_tags.get(user_id, 0.0))
+        self._finish_tags[user_id] = start + cost / weight
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (start, next(self._seq), cost, future))
+        self._depth[user_id] = self._depth.get(user_id, 0) + 1
+        usage["queued"] += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        enqueued = self.clock()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if not (future.done() and not future.cancelled()):
+                future.cancel()
+                usage["rejected"] += 1
+                raise QuotaExceeded(
+                    f"{self.name} quota is saturated; please retry shortly.",
+                    retry_after=max(1.0, self.bucket.time_until_available(cost))
+                )
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        finally:
+            self._depth[user_id] -= 1
+            if not self._depth[user_id]:
+                del self._depth[user_id]
+        self._admit(usage, cost, self.clock() - enqueued)
+
+    async def _dispatch(self):
+        """Hand out tokens to queued requests in start-tag order."""
+        while self._heap:
+            start, _, cost, future = self._heap[0]
+            if future.done():
+                heapq.heappop(self._heap)
+                continue
+            delay = self.bucket.time_until_available(cost)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self.bucket.try_take(cost)
+            heapq.heappop(self._heap)
+            self._virtual_time = start
+            future.set_result(True)
+            if len(self._finish_tags) > 2 * len(self._heap) + 64:
+                self._prune_finish_tags()
+        # Idle: virtual time jumps to the last finish tag, so no tag matters any more
+        self._virtual_time = max([self._virtual_time, *self._finish_tags.values()])
+        self._finish_tags.clear()
+
+
+def _parse_weights(value):
+    """Parse 'user_a=2,user_b=0.5' into a weights dict."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        user_id, _, weight = item.partition('=')
+        weights[user_id.strip()] = float(weight)
+    return weights
+
+
+def create_scheduler(name, per_minute, burst=None, max_wait=10.0, max_queue_per_user=20):
+    """
+    Build the scheduler for an upstream, with environment overrides:
+    <NAME>_QUOTA_PER_MINUTE, <NAME>_QUOTA_BURST, <NAME>_QUOTA_MAX_WAIT,
+    <NAME>_QUOTA_MAX_QUEUE, <NAME>_QUOTA_WEIGHTS ('user=2,other=0.5'),
+    <NAME>_QUOTA_USAGE_TTL and <NAME>_QUOTA_MAX_USERS.
+    """
+    prefix = f"{name.upper()}_QUOTA_"
+    per_minute = float(os.environ.get(prefix + "PER_MINUTE", per_minute))
+    burst = os.environ.get(prefix + "BURST", burst)
+    return FairScheduler(
+        name,
+        rate=per_minute / 60.0,
+        burst=float(burst) if burst is not None else None,
+        max_wait=float(os.environ.get(prefix + "MAX_WAIT", max_wait)),
+        max_queue_per_user=int(os.environ.get(prefix + "MAX_QUEUE", max_queue_per_user)),
+        weights=_parse_weights(os.environ.get(prefix + "WEIGHTS")),
+        usage_ttl=float(os.environ.get(prefix + "USAGE_TTL", 3600.0)),
+        max_tracked_users=int(os.environ.get(prefix + "MAX_USERS", 10000)),
+    )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The shared package is imported as `common`, as the services do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from common.blob_store import BlobStore, LocalBlobStore, S3BlobStore, sha256_bytes
+
+
+@pytest.fixture
+def local_store(tmp_path):
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def s3_store(monkeypatch):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="audio")
+        yield S3BlobStore(client, "audio", prefix="blobs/")
+
+
+@pytest.fixture(params=["local", "s3"])
+def store(request):
+    return request.getfixturevalue(f"{request.param}_store")
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        BlobStore()
+
+
+def test_identical_payloads_are_stored_once(store):
+    first = store.put(b"payload", "request:1")
+    second = store.put(b"payload", "request:2")
+    assert first == second == sha256_bytes(b"payload")
+    assert store.refcount(first) == 2
+    assert store.get(first) == b"payload"
+
+
+def test_blob_is_deleted_with_its_last_reference(store):
+    digest = store.put(b"payload", "request:1")
+    store.add_ref(digest, "document:1")
+    store.add_ref(digest, "document:1")
+    assert store.refcount(digest) == 2
+
+    assert store.release(digest, "request:1") is False
+    assert store.exists(digest)
+    assert store.release(digest, "document:1") is True
+    assert not store.exists(digest)
+    assert store.refcount(digest) == 0
+
+
+def test_local_put_file_moves_new_content_and_drops_duplicates(local_store, tmp_path):
+    first = tmp_path / "upload-1"
+    first.write_bytes(b"scan")
+    digest = local_store.put_file(str(first), "request:1")
+    assert not first.exists()
+    assert open(local_store.path(digest), "rb").read() == b"scan"
+
+    second = tmp_path / "upload-2"
+    second.write_bytes(b"scan")
+    assert local_store.put_file(str(second), "request:2") == digest
+    assert not second.exists()
+    assert local_store.refcount(digest) == 2
+    assert not [name for name in os.listdir(local_store.root) if name.startswith(".upload-")]
+
+
+def test_local_refs_filters_by_prefix_and_age(local_store):
+    one = local_store.put(b"one", "request:1")
+    two = local_store.put(b"two", "document:2")
+    local_store.add_ref(two, "REQUEST:3")
+
+    assert local_store.refs("request:") == [(one, "request:1")]
+    assert len(local_store.refs()) == 3
+    assert local_store.refs("request:", older_than=0) == []
+
+
+def test_s3_layout_and_checksum(s3_store):
+    digest = s3_store.put(b"audio", "private/u/audio/1.json", metadata={"user_id": "u"}, content_type="audio/wav")
+    client = s3_store.client
+    head = client.head_object(Bucket="audio", Key=s3_store.key(digest), ChecksumMode="ENABLED")
+    assert s3_store.key(digest) == f"blobs/sha256/{digest[:2]}/{digest}"
+    assert head["ContentType"] == "audio/wav"
+    markers = client.list_objects_v2(Bucket="audio", Prefix=f"blobs/refs/{digest}/")["Contents"]
+    assert [marker["Key"] for marker in markers] == [f"blobs/refs/{digest}/private%2Fu%2Faudio%2F1.json"]
+
+
+def test_s3_calls_go_through_the_wrapper(s3_store):
+    calls = []
+
+    def call(fn, *args, **kwargs):
+        calls.append(fn.__name__)
+        return fn(*args, **kwargs)
+
+    store = S3BlobStore(s3_store.client, "audio", call=call)
+    store.put(b"audio", "request:1")
+    assert calls == ["put_object", "_head", "put_object"]
+
+
+def test_s3_dedup_miss_is_not_an_upstream_failure(s3_store):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from common.upstream import Upstream
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        upstream = Upstream("s3", executor=executor, timeout=10.0)
+        store = S3BlobStore(s3_store.client, "audio", call=upstream.call)
+        digest = store.put(b"new audio", "request:1")
+        assert not store.exists("0" * 64)
+        store.put(b"new audio", "request:2")
+        metrics = upstream.metrics()
+        assert store.refcount(digest) == 2
+
+    assert metrics["failures"] == 0
+    assert metrics["successes"] == metrics["calls"] == 6
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("httpx")
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.profiling import install_profiling, stage
+
+
+def make_app(**kwargs):
+    app = FastAPI()
+
+    @app.get("/work")
+    def work():
+        with stage("step"):
+            return {"ok": True}
+
+    installed = install_profiling(app, **kwargs)
+    return app, installed
+
+
+def test_disabled_installs_nothing():
+    app, installed = make_app(enabled=False, admin_token="secret")
+    assert installed is False
+    assert TestClient(app).get("/admin/slow-requests").status_code == 404
+
+
+def test_enabled_without_token_fails_closed(monkeypatch):
+    monkeypatch.delenv("PROFILING_ADMIN_TOKEN", raising=False)
+    app, installed = make_app(enabled=True)
+    assert installed is False
+    client = TestClient(app)
+    assert client.get("/admin/slow-requests").status_code == 404
+    assert client.get("/admin/profile", params={"seconds": 0.01}).status_code == 404
+
+
+def test_admin_routes_require_token(monkeypatch):
+    monkeypatch.setattr("common.profiling.SLOW_REQUEST_THRESHOLD_MS", 0.0)
+    app, installed = make_app(enabled=True, admin_token="secret")
+    assert installed is True
+    client = TestClient(app)
+    assert client.get("/admin/slow-requests").status_code == 403
+    assert client.get("/admin/slow-requests", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/profile", params={"seconds": 0.01}).status_code == 403
+
+    assert client.get("/work").status_code == 200
+    response = client.get("/admin/slow-requests", params={"path": "/work"}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    [entry] = response.json()["requests"]
+    assert [timing["stage"] for timing in entry["stages"]] == ["step"]
+
+    response = client.get("/admin/profile", params={"seconds": 0.01}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from common.quota import FairScheduler, QuotaExceeded, TokenBucket, _parse_weights
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock)
+    assert bucket.try_take() and bucket.try_take()
+    assert not bucket.try_take()
+    assert bucket.time_until_available() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.try_take()
+
+
+def test_users_are_served_fairly():
+    async def scenario():
+        scheduler = FairScheduler("test", rate=50.0, burst=1, max_wait=5.0)
+        order = []
+
+        async def request(user_id):
+            await scheduler.acquire(user_id)
+            order.append(user_id)
+
+        # A user with a deep backlog does not starve a user who arrives later
+        await asyncio.gather(*[request("heavy") for _ in range(6)], request("light"))
+        return order
+
+    order = asyncio.run(scenario())
+    assert order.index("light") <= 2
+
+
+def test_per_user_queue_is_capped():
+    async def scenario():
+        scheduler = FairScheduler("test", rate=1.0, burst=1, max_wait=0.2, max_queue_per_user=2)
+        return await asyncio.gather(
+            *[scheduler.acquire("user") for _ in range(4)], return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert results[0] is None
+    assert all(isinstance(result, QuotaExceeded) for result in results[1:])
+
+
+def test_finish_tags_are_pruned_once_passed():
+    async def scenario():
+        scheduler = FairScheduler("test", rate=500.0, burst=1, max_wait=5.0)
+        await asyncio.gather(*[scheduler.acquire(f"user-{i}") for i in range(200)])
+        await scheduler._dispatcher
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler._finish_tags == {}
+    assert scheduler._virtual_time == 1.0
+
+
+def test_idle_usage_expires():
+    async def scenario():
+        clock = FakeClock()
+        scheduler = FairScheduler("test", rate=1000.0, burst=100, usage_ttl=60.0, clock=clock)
+        await scheduler.acquire("old")
+        clock.now = 61.0
+        await scheduler.acquire("new")
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert list(scheduler._usage) == ["new"]
+    assert scheduler.usage("old")["requests"] == 0
+
+
+def test_usage_is_capped_at_max_tracked_users():
+    async def scenario():
+        scheduler = FairScheduler("test", rate=1000.0, burst=1000, max_tracked_users=10)
+        for i in range(50):
+            await scheduler.acquire(f"user-{i}")
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert len(scheduler._usage) == 10
+    assert "user-49" in scheduler._usage and "user-0" not in scheduler._usage
+
+
+def test_global_usage_does_not_list_users():
+    async def scenario():
+        scheduler = FairScheduler("test", rate=1000.0, burst=10)
+        await scheduler.acquire("10.0.0.1", cost=2)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    totals = scheduler.usage()
+    assert "users" not in totals and totals["tracked_users"] == 1
+    assert scheduler.usage("10.0.0.1")["units"] == 2
+    # Looking up an unknown user does not start tracking it
+    scheduler.usage("someone-else")
+    assert scheduler.usage()["tracked_users"] == 1
+
+
+def test_parse_weights():
+    assert _parse_weights("a=2, b=0.5,") == {"a": 2.0, "b": 0.5}
+    assert _parse_weights(None) == {}
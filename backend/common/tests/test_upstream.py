@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from common.upstream import (
+    CircuitBreaker, CircuitOpenError, Upstream, UpstreamError, UpstreamOverloaded, UpstreamTimeout,
+    is_transient,
+)
+
+
+class ServiceUnavailable(Exception):
+    """Stand-in for google.api_core.exceptions.ServiceUnavailable"""
+    code = 503
+
+
+class FakeUpstream:
+    """Fault-injecting fake: fails the first `failures` calls, and every call takes `latency` seconds."""
+
+    def __init__(self, latency=0.0, failures=0, error=ServiceUnavailable):
+        self.latency = latency
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, value="ok"):
+        with self._lock:
+            self.calls += 1
+            fail = self.calls <= self.failures
+        time.sleep(self.latency)
+        if fail:
+            raise self.error("injected failure")
+        return value
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=8)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def make_upstream(executor, **kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=3, reset_timeout=0.2))
+    return Upstream("fake", executor=executor, sleep=lambda delay: None, **kwargs)
+
+
+def test_transient_errors_are_retried(executor):
+    fake = FakeUpstream(failures=2)
+    upstream = make_upstream(executor, timeout=5.0, max_attempts=3,
+                             breaker=CircuitBreaker(failure_threshold=5))
+    assert upstream.call(fake, "done") == "done"
+    assert fake.calls == 3
+    metrics = upstream.metrics()
+    assert metrics["retries"] == 2 and metrics["successes"] == 1
+    assert metrics["state"] == CircuitBreaker.CLOSED
+
+
+def test_non_idempotent_calls_are_not_retried(executor):
+    fake = FakeUpstream(failures=1)
+    upstream = make_upstream(executor, timeout=5.0, max_attempts=3)
+    with pytest.raises(ServiceUnavailable):
+        upstream.call(fake, idempotent=False)
+    assert fake.calls == 1
+
+
+def test_permanent_errors_do_not_trip_the_breaker(executor):
+    fake = FakeUpstream(failures=10, error=ValueError)
+    upstream = make_upstream(executor, timeout=5.0)
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            upstream.call(fake)
+    assert fake.calls == 5
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_slow_upstream_times_out_and_opens_the_breaker(executor):
+    fake = FakeUpstream(latency=0.3)
+    upstream = make_upstream(executor, timeout=0.1, max_attempts=1)
+    for _ in range(3):
+        with pytest.raises(UpstreamTimeout):
+            upstream.call(fake)
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        upstream.call(fake)
+    assert upstream.metrics()["short_circuited"] == 1
+
+    # After the reset timeout a single probe is let through and closes the circuit
+    fake.latency = 0.0
+    time.sleep(0.25)
+    assert upstream.call(fake, "recovered") == "recovered"
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_hedged_request_wins_over_a_slow_first_attempt(executor):
+    latencies = iter([1.0, 0.0])
+
+    def fake():
+        time.sleep(next(latencies))
+        return "hedged"
+
+    upstream = make_upstream(executor, timeout=2.0, hedge_after=0.05)
+    started = time.monotonic()
+    assert upstream.call(fake) == "hedged"
+    assert time.monotonic() - started < 0.5
+    metrics = upstream.metrics()
+    assert metrics["hedged"] == 1 and metrics["hedge_wins"] == 1
+
+
+def test_local_queueing_does_not_count_against_the_deadline():
+    # Healthy upstream, but more callers than local worker threads
+    fake = FakeUpstream(latency=0.45)
+    executor = ThreadPoolExecutor(max_workers=2)
+    upstream = make_upstream(executor, timeout=0.5, max_attempts=1, queue_timeout=5.0)
+    with ThreadPoolExecutor(max_workers=8) as callers:
+        results = list(callers.map(lambda _: upstream.call(fake), range(8)))
+    executor.shutdown()
+    assert results == ["ok"] * 8
+    metrics = upstream.metrics()
+    assert metrics["timeouts"] == 0
+    assert metrics["state"] == CircuitBreaker.CLOSED
+
+
+def test_queue_timeouts_are_shed_without_tripping_the_breaker():
+    fake = FakeUpstream(latency=0.45)
+    executor = ThreadPoolExecutor(max_workers=2)
+    upstream = make_upstream(executor, timeout=0.5, max_attempts=1, queue_timeout=0.1)
+
+    def call(_):
+        try:
+            return upstream.call(fake)
+        except UpstreamError as e:
+            return type(e)
+
+    with ThreadPoolExecutor(max_workers=8) as callers:
+        results = list(callers.map(call, range(8)))
+    executor.shutdown()
+
+    assert UpstreamTimeout not in results
+    assert results.count("ok") >= 2
+    assert results.count(UpstreamOverloaded) == 8 - results.count("ok")
+    metrics = upstream.metrics()
+    assert metrics["shed"] == results.count(UpstreamOverloaded)
+    assert metrics["state"] == CircuitBreaker.CLOSED
+
+
+def test_shed_probe_releases_the_half_open_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_is_transient():
+    assert is_transient(ServiceUnavailable())
+    assert is_transient(UpstreamTimeout())
+    assert not is_transient(ValueError())
+
+    class ClientError(Exception):
+        response = {"ResponseMetadata": {"HTTPStatusCode": 503}}
+
+    assert is_transient(ClientError())
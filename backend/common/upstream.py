@@ -0,0 +1,362 @@
+"""
+Resilient wrapper for calls to upstream cloud services (Vision, Gemini, S3).
+Each named upstream gets per-call deadlines, bounded retries with jittered
+backoff for idempotent operations, optional hedged requests and a circuit
+breaker, along with counters for every outcome and breaker state.
+
+Calls run on a bounded local thread pool. The deadline starts when an attempt
+begins running, so time spent waiting for a local thread is not blamed on the
+upstream; an attempt that cannot get a thread within its queue timeout is
+shed with UpstreamOverloaded and does not count as an upstream failure.
+
+Timing and scheduling are injectable (clock, sleep, executor) so the wrapper
+can be exercised against fault-injecting local fakes.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth retrying (google.api_core errors expose .code,
+# botocore ClientError carries it in the response metadata)
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_ERROR_NAMES = {
+    "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "TooManyRequests",
+    "EndpointConnectionError", "ConnectTimeoutError", "ReadTimeoutError", "ConnectionClosedError",
+}
+
+# Upstream calls run on a bounded pool so a hung upstream cannot pile up threads
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('UPSTREAM_MAX_THREADS', '32')),
+    thread_name_prefix="upstream"
+)
+
+
+class UpstreamError(Exception):
+    """Base class for errors raised by the upstream wrapper itself."""
+
+
+class UpstreamTimeout(UpstreamError):
+    """The call did not complete before its deadline."""
+
+
+class CircuitOpenError(UpstreamError):
+    """The circuit breaker is open and the call was shed without being attempted."""
+
+
+class UpstreamOverloaded(UpstreamError):
+    """No local worker thread became free in time; the call was shed without being attempted."""
+
+
+def is_transient(exc):
+    """Whether an exception looks like a temporary upstream failure worth retrying."""
+    if isinstance(exc, (UpstreamTimeout, TimeoutError, ConnectionError)):
+        return True
+    if type(exc).__name__ in TRANSIENT_ERROR_NAMES:
+        return True
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int) and code in TRANSIENT_STATUS_CODES:
+        return True
+    response = getattr(exc, 'response', None)
+    if isinstance(response, dict):
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return status in TRANSIENT_STATUS_CODES
+    return False
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker.
+
+    closed    - calls pass through; consecutive failures are counted
+    open      - calls are rejected until reset_timeout has elapsed
+    half_open - a single probe call is let through; success closes the
+                circuit, failure opens it again
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.transitions = {self.CLOSED: 0, self.OPEN: 0, self.HALF_OPEN: 0}
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            self.transitions[state] += 1
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            return self._state
+
+    def allow(self):
+        """Return True if a call may be attempted now."""
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state(self.CLOSED)
+
+    def release(self):
+        """Give back a half-open probe slot when the call was never sent upstream."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+                self._set_state(self.OPEN)
+
+
+class _Deadline:
+    """Deadline of one call, started when its first attempt begins running."""
+
+    def __init__(self, timeout, clock):
+        self.timeout = timeout
+        self.clock = clock
+        self.expires_at = None
+
+    def start(self):
+        if self.expires_at is None:
+            self.expires_at = self.clock() + self.timeout
+
+    def remaining(self):
+        if self.expires_at is None:
+            return self.timeout
+        return self.expires_at - self.clock()
+
+
+class Upstream:
+    """
+    A named upstream dependency with its call policy.
+
+    Args:
+        name (str): Name used in logs and metrics
+        timeout (float): Deadline in seconds for the whole call, retries included,
+            counted from when the first attempt starts running
+        queue_timeout (float): Longest wait for a free local worker thread before
+            the call is shed (default: timeout)
+        max_attempts (int): Attempts for idempotent calls (non-idempotent calls get one)
+        backoff_base (float): Base delay for exponential backoff with full jitter
+        backoff_max (float): Upper bound on a single backoff delay
+        hedge_after (float): Send a second, hedged attempt if the first has not
+            completed after this many seconds (None disables hedging)
+        breaker (CircuitBreaker): Breaker shared by all calls to this upstream
+        retry_if (callable): Predicate deciding whether an exception is retryable
+    """
+
+    def __init__(self, name, timeout=30.0, max_attempts=3, backoff_base=0.2, backoff_max=2.0,
+                 hedge_after=None, breaker=None, retry_if=is_transient, queue_timeout=None,
+                 clock=time.monotonic, sleep=time.sleep, executor=None):
+        self.name = name
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout if queue_timeout is not None else timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.retry_if = retry_if
+        self.clock = clock
+        self.sleep = sleep
+        self.executor = executor or _executor
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0, "successes": 0, "failures": 0, "timeouts": 0,
+            "retries": 0, "hedged": 0, "hedge_wins": 0, "short_circuited": 0, "shed": 0,
+        }
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["state"] = self.breaker.state
+        counters["state_transitions"] = dict(self.breaker.transitions)
+        return counters
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+    def _submit(self, fn, args, kwargs):
+        """Submit one attempt; the returned event is set once it starts running."""
+        started = threading.Event()
+
+        def run():
+            started.set()
+            return fn(*args, **kwargs)
+
+        return self.executor.submit(run), started
+
+    def _attempt(self, fn, args, kwargs, deadline, hedge):
+        """
+        Run one (possibly hedged) attempt.
+
+        Raises UpstreamOverloaded if no worker thread picks it up within
+        queue_timeout, and UpstreamTimeout once it has run past the deadline.
+        """
+        future, started = self._submit(fn, args, kwargs)
+        if not started.wait(self.queue_timeout) and future.cancel():
+            raise UpstreamOverloaded(
+                f"No free worker for {self.name} call within {self.queue_timeout:.1f}s; shedding request"
+            )
+        deadline.start()
+
+        futures = [future]
+        if hedge and self.hedge_after is not None and self.hedge_after < deadline.remaining():
+            done, _ = wait(futures, timeout=self.hedge_after)
+            if not done:
+                self._count("hedged")
+                futures.append(self._submit(fn, args, kwargs)[0])
+
+        error = None
+        pending = set(futures)
+        while pending:
+            left = deadline.remaining()
+            if left <= 0:
+                break
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self._count("hedge_wins")
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        for future in pending:
+            future.cancel()
+        if error is not None and not pending:
+            raise error
+        raise UpstreamTimeout(f"{self.name} call exceeded its {self.timeout:.1f}s deadline")
+
+    def call(self, fn, *args, idempotent=True, **kwargs):
+        """
+        Call fn(*args, **kwargs) under this upstream's policy.
+
+        Raises:
+            CircuitOpenError: the breaker is open, nothing was attempted
+            UpstreamOverloaded: no local worker was free in time, nothing was attempted
+            UpstreamTimeout: the deadline passed before a successful attempt
+            Exception: the last error raised by fn
+        """
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError(f"{self.name} circuit is open; shedding request")
+
+        deadline = _Deadline(self.timeout, self.clock)
+        attempts = self.max_attempts if idempotent else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                if deadline.remaining() <= 0:
+                    raise UpstreamTimeout(f"{self.name} call exceeded its {self.timeout:.1f}s deadline")
+                result = self._attempt(fn, args, kwargs, deadline, hedge=idempotent)
+            except UpstreamOverloaded as e:
+                # Local overload says nothing about the upstream's health
+                self.breaker.release()
+                self._count("shed")
+                logger.warning(str(e))
+                raise
+            except Exception as e:
+                if isinstance(e, UpstreamTimeout):
+                    self._count("timeouts")
+                if not self.retry_if(e):
+                    self.breaker.record_success()
+                    self._count("failures")
+                    raise
+                self.breaker.record_failure()
+                delay = self._backoff(attempt)
+                last_attempt = (
+                    attempt == attempts
+                    or self.breaker.state != CircuitBreaker.CLOSED
+                    or delay >= deadline.remaining()
+                )
+                if last_attempt:
+                    self._count("failures")
+                    logger.warning(f"{self.name} call failed after {attempt} attempt(s): {e}")
+                    raise
+                self._count("retries")
+                logger.info(f"{self.name} attempt {attempt} failed ({e}); retrying in {delay:.2f}s")
+                self.sleep(delay)
+            else:
+                self.breaker.record_success()
+                self._count("successes")
+                return result
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def get_upstream(name, timeout=30.0, max_attempts=3, hedge_after=None,
+                 failure_threshold=5, reset_timeout=30.0, queue_timeout=None):
+    """
+    Return the shared Upstream for name, creating it on first use.
+
+    The defaults can be overridden per upstream with environment variables,
+    e.g. UPSTREAM_VISION_TIMEOUT, UPSTREAM_VISION_MAX_ATTEMPTS,
+    UPSTREAM_VISION_HEDGE_AFTER, UPSTREAM_VISION_FAILURE_THRESHOLD,
+    UPSTREAM_VISION_RESET_TIMEOUT and UPSTREAM_VISION_QUEUE_TIMEOUT.
+    """
+    with _registry_lock:
+        upstream = _registry.get(name)
+        if upstream is None:
+            prefix = f"UPSTREAM_{name.upper()}_"
+            breaker = CircuitBreaker(
+                failure_threshold=int(_env_float(prefix + "FAILURE_THRESHOLD", failure_threshold)),
+                reset_timeout=_env_float(prefix + "RESET_TIMEOUT", reset_timeout),
+            )
+            upstream = Upstream(
+                name,
+                timeout=_env_float(prefix + "TIMEOUT", timeout),
+                max_attempts=int(_env_float(prefix + "MAX_ATTEMPTS", max_attempts)),
+                hedge_after=_env_float(prefix + "HEDGE_AFTER", hedge_after),
+                queue_timeout=_env_float(prefix + "QUEUE_TIMEOUT", queue_timeout),
+                breaker=breaker,
+            )
+            _registry[name] = upstream
+        return upstream
+
+
+def upstream_metrics():
+    """Counters and breaker state for every upstream created so far."""
+    with _registry_lock:
+        upstreams = list(_registry.values())
+    return {upstream.name: upstream.metrics() for upstream in upstreams}
@@ -0,0 +1,60 @@
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cold-start budget for importing a service's main module (IMPORT_TIME_BUDGET_MS)
+IMPORT_TIME_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', '2000'))
+
+
+def _profile_import(service, module="main", requires=(), env=None, cwd=None):
+    """
+    Import a service module in a fresh interpreter under `python -X importtime`.
+
+    Skips the calling test when one of the required third-party packages is
+    not installed.
+
+    Returns:
+        tuple: (cumulative import time of the module in ms, set of imported module names)
+    """
+    missing = [name for name in requires if importlib.util.find_spec(name) is None]
+    if missing:
+        pytest.skip(f"{service} dependencies not installed: {', '.join(missing)}")
+
+    service_dir = os.path.join(BACKEND_DIR, service)
+    child_env = dict(os.environ, **(env or {}))
+    child_env["PYTHONPATH"] = os.pathsep.join([service_dir, BACKEND_DIR])
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd or service_dir, env=child_env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    cumulative_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(cumulative)
+    assert cumulative_us is not None, f"{module} was not imported"
+    return cumulative_us / 1000, imported
+
+
+@pytest.fixture
+def profile_import():
+    """Profile the cold import of a service module (see _profile_import)"""
+    return _profile_import
+
+
+@pytest.fixture
+def import_time_budget_ms():
+    return IMPORT_TIME_BUDGET_MS